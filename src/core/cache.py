@@ -0,0 +1,212 @@
+# coding: utf-8
+
+import threading
+import time
+from functools import wraps
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+from django.utils import translation
+from .compression import compressible, compress_all
+
+# 30 dias, o maior timeout relativo aceito pelo memcached
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+# chamadas adiadas para o fim do request, por thread
+pending = threading.local()
+
+
+def after_commit(func, *args):
+    """
+    Dentro de uma transacao gerenciada, como as views do admin, executa
+    func(*args) de novo no fim do request, depois do commit. As versoes sao
+    trocadas nos sinais, antes do commit, e um render nesse intervalo
+    guardaria os dados antigos sob a versao nova.
+    """
+    if transaction.is_managed():
+        calls = pending.__dict__.setdefault('calls', [])
+        if (func, args) not in calls:
+            calls.append((func, args))
+
+
+def forget_pending(**kwargs):
+    pending.calls = []
+
+
+def run_pending(**kwargs):
+    calls, pending.calls = getattr(pending, 'calls', []), []
+    for func, args in calls:
+        func(*args)
+
+
+request_started.connect(forget_pending)
+request_finished.connect(run_pending)
+
+
+def version_key(model, pk):
+    return 'version:%s:%s' % (model._meta.db_table, pk)
+
+
+def new_version():
+    # uma versao perdida pelo cache recomeca de um valor nunca usado
+    return int(time.time() * 1000)
+
+
+def get_versions(model, pks):
+    """Versoes de varios objetos com uma unica ida ao cache"""
+    keys = dict((version_key(model, pk), pk) for pk in pks)
+    found = cache.get_many(keys.keys())
+    versions = dict((keys[key], value) for key, value in found.items())
+
+    missing = dict((key, new_version()) for key, pk in keys.items()
+                   if pk not in versions)
+    if missing:
+        cache.set_many(missing, VERSION_TIMEOUT)
+        versions.update((keys[key], value) for key, value in missing.items())
+    return versions
+
+
+def bump_versions(model, pks):
+    """Invalida os fragmentos em cache dos objetos"""
+    for pk in set(pks):
+        key = version_key(model, pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, new_version(), VERSION_TIMEOUT)
+
+
+SITE_VERSION_KEY = 'version:site'
+
+
+def bump_key(key):
+    """Troca a versao guardada na chave e retorna a nova"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = new_version()
+        cache.set(key, version, VERSION_TIMEOUT)
+        return version
+
+
+def get_key_version(key):
+    """Versao atual da chave, criada se o cache nao a tiver"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_site_version():
+    """Invalida as paginas publicas guardadas pelo anonymous_cache"""
+    bump_key(SITE_VERSION_KEY)
+
+
+def anonymous_cache(view):
+    """
+    Guarda a resposta completa para visitantes anonimos, por caminho e
+    idioma. Apos PUBLIC_CACHE_TIMEOUT a pagina fica velha: um unico
+    request a regenera, protegido por um lock no cache, enquanto os
+    demais recebem a versao velha por ate PUBLIC_CACHE_STALE segundos.
+    Sem versao velha, esperam a nova por ate PUBLIC_CACHE_WAIT segundos
+    e depois recebem 503.
+
+    O ETag, posto pela view ao gerar a pagina, e guardado junto com ela:
+    uma pagina velha sai sempre com o seu proprio ETag, e o If-None-Match
+    e respondido pela entrada do cache sem consultar o banco.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated():
+            return view(request, *args, **kwargs)
+
+        timeout = getattr(settings, 'PUBLIC_CACHE_TIMEOUT', 60)
+        stale = getattr(settings, 'PUBLIC_CACHE_STALE', 600)
+        key = 'response:%s:%s' % (
+            translation.get_language(),
+            md5(request.get_full_path()).hexdigest())
+        lock_key = key + ':lock'
+
+        found = cache.get_many([key, SITE_VERSION_KEY])
+        entry = found.get(key)
+        site_version = found.get(SITE_VERSION_KEY)
+
+        fresh = (entry is not None and entry['version'] == site_version
+                 and entry['expires'] > time.time())
+        if fresh:
+            return build_response(entry, request)
+
+        if not cache.add(lock_key, True, getattr(settings, 'PUBLIC_CACHE_LOCK', 30)):
+            # outro request ja esta regenerando esta pagina
+            busy = False
+            if entry is None:
+                entry, busy = wait_for_entry(
+                    key, lock_key, getattr(settings, 'PUBLIC_CACHE_WAIT', 5))
+            if entry is not None:
+                return build_response(entry, request)
+            if busy:
+                response = HttpResponse('Servico indisponivel', status=503)
+                response['Retry-After'] = 1
+                return response
+            # quem tinha o lock nao guardou a pagina, como num 404
+            return view(request, *args, **kwargs)
+
+        try:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                # comprime uma vez por versao da pagina, nao a cada acesso
+                response.compressed = (compressible(response)
+                                       and compress_all(response.content) or {})
+                cache.set(key, {
+                    'content': response.content,
+                    'compressed': response.compressed,
+                    'status': response.status_code,
+                    'headers': response.items(),
+                    'version': site_version,
+                    'expires': time.time() + timeout,
+                }, timeout + stale)
+            return response
+        finally:
+            cache.delete(lock_key)
+    # o prerender_site precisa sempre da pagina atual, nunca da velha
+    wrapper.uncached = view
+    return wrapper
+
+
+def wait_for_entry(key, lock_key, timeout, interval=0.05):
+    """
+    Espera a entrada gravada por quem tem o lock. Retorna (entrada, False),
+    (None, False) se o lock foi solto sem ela ou (None, True) se o tempo
+    acabou com o lock ainda preso.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        time.sleep(interval)
+        found = cache.get_many([key, lock_key])
+        if key in found:
+            return found[key], False
+        if lock_key not in found:
+            return None, False
+    return None, True
+
+
+def build_response(entry, request=None):
+    etag = dict(entry['headers']).get('ETag')
+    if etag and request is not None:
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match == '*' or
+                              parse_etags(etag)[0] in parse_etags(if_none_match)):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+    response = HttpResponse(entry['content'], status=entry['status'])
+    for header, value in entry['headers']:
+        response[header] = value
+    response.compressed = entry.get('compressed', {})
+    return response
@@ -0,0 +1,65 @@
+# coding: utf-8
+
+import gzip
+import re
+from StringIO import StringIO
+import brotli
+
+# abaixo disso os cabecalhos do gzip/brotli anulam o ganho
+MIN_LENGTH = 200
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|javascript|xml))')
+
+
+def gzip_compress(content, level=6):
+    buf = StringIO()
+    # mtime fixo: o mesmo conteudo sempre gera o mesmo corpo
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(content)
+    return buf.getvalue()
+
+
+def brotli_compress(content, quality=5):
+    return brotli.compress(content, quality=quality)
+
+
+# em ordem de preferencia
+ENCODINGS = ('br', 'gzip')
+COMPRESSORS = {
+    'br': brotli_compress,
+    'gzip': gzip_compress,
+}
+
+
+def compress(encoding, content):
+    return COMPRESSORS[encoding](content)
+
+
+def compress_all(content):
+    """Corpo em cada codificacao, guardado junto da resposta em cache"""
+    return dict((encoding, compress(encoding, content)) for encoding in ENCODINGS)
+
+
+def compressible(response):
+    if (response.status_code != 200 or response.has_header('Content-Encoding')
+            or getattr(response, '_base_content_is_iter', False)):
+        return False
+    return (COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')) is not None
+            and len(response.content) >= MIN_LENGTH)
+
+
+def negotiate(accept_encoding):
+    """Codificacao preferida entre as aceitas pelo cliente, ou None"""
+    accepted = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0
+        accepted[coding.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, 0) > 0:
+            return encoding
@@ -0,0 +1,123 @@
+# coding: utf-8
+
+import threading
+import time
+
+
+class PoolExhausted(Exception):
+    """Todas as conexoes do processo seguiram em uso ate o timeout"""
+
+
+def is_usable(connection):
+    """Health check: uma ida ao banco com SELECT 1"""
+    if connection.closed:
+        return False
+    try:
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool(object):
+    """
+    Conexoes compartilhadas pelas threads de um processo. No maximo size
+    conexoes ficam abertas; quem passar disso espera ate timeout segundos.
+    Conexoes com mais de max_lifetime segundos sao fechadas na devolucao ou
+    na retirada, e as paradas ha mais de check_after segundos passam por um
+    health check antes de voltar ao uso.
+    """
+    def __init__(self, size=5, max_lifetime=600, check_after=30, timeout=5):
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        # (conexao, devolvida em); a ultima devolvida sai primeiro
+        self.idle = []
+        self.created = {}
+        self.in_use = 0
+
+    def get(self, connect):
+        """Retira uma conexao; connect() abre uma nova quando necessario"""
+        deadline = time.time() + self.timeout
+        while True:
+            connection, released_at = self._checkout(deadline)
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+                self.created[connection] = time.time()
+                return connection
+            if self._reusable(connection, released_at):
+                return connection
+            self._discard(connection)
+
+    def put(self, connection):
+        """Devolve a conexao ao fim do request, sem transacao aberta"""
+        reusable = not connection.closed and not self._expired(connection)
+        if reusable:
+            try:
+                connection.rollback()
+            except Exception:
+                reusable = False
+        if not reusable:
+            self._discard(connection)
+            return
+        with self.condition:
+            self.in_use -= 1
+            self.idle.append((connection, time.time()))
+            self.condition.notify()
+
+    def close_all(self):
+        """Fecha as conexoes paradas; as em uso fecham na devolucao"""
+        with self.condition:
+            idle, self.idle = self.idle, []
+        for connection, released_at in idle:
+            self.created.pop(connection, None)
+            close_quietly(connection)
+
+    def _checkout(self, deadline):
+        with self.condition:
+            while not self.idle and self.in_use >= self.size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolExhausted(
+                        u'%d conexoes em uso ha %s segundos' % (self.in_use, self.timeout))
+                self.condition.wait(remaining)
+            self.in_use += 1
+            if self.idle:
+                return self.idle.pop()
+            return None, None
+
+    def _expired(self, connection):
+        created = self.created.get(connection, 0)
+        return time.time() - created > self.max_lifetime
+
+    def _reusable(self, connection, released_at):
+        if connection.closed or self._expired(connection):
+            return False
+        if time.time() - released_at > self.check_after:
+            return is_usable(connection)
+        return True
+
+    def _discard(self, connection):
+        self.created.pop(connection, None)
+        close_quietly(connection)
+        self._release_slot()
+
+    def _release_slot(self):
+        with self.condition:
+            self.in_use -= 1
+            self.condition.notify()
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import threading
+import time
+from django.conf import settings
+from django.core import signals
+from django.db import close_connection, connections
+from django.db.backends.postgresql_psycopg2 import base
+from src.core.db.pool import ConnectionPool, close_quietly, is_usable
+
+DatabaseError = base.DatabaseError
+IntegrityError = base.IntegrityError
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    """Um pool por banco e por processo"""
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = ConnectionPool(
+                size=settings_dict['POOL_SIZE'],
+                max_lifetime=settings_dict.get('CONN_MAX_AGE') or 600,
+                check_after=settings_dict.get('CONN_CHECK_AFTER', 30),
+                timeout=settings_dict.get('POOL_TIMEOUT', 5))
+        return pools[alias]
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL com conexoes que sobrevivem ao request. Com CONN_MAX_AGE a
+    conexao de cada thread e reaproveitada por ate esse numero de segundos;
+    com POOL_SIZE as threads do processo dividem um pool desse tamanho.
+    Conexoes paradas ha mais de CONN_CHECK_AFTER segundos passam por um
+    SELECT 1 antes de voltar ao uso.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.max_age = self.settings_dict.get('CONN_MAX_AGE') or 0
+        self.check_after = self.settings_dict.get('CONN_CHECK_AFTER', 30)
+        self.pool = None
+        if self.settings_dict.get('POOL_SIZE'):
+            self.pool = get_pool(self.alias, self.settings_dict)
+        self.connected_at = None
+        self.released_at = None
+
+    def connect(self):
+        """Abre uma conexao nova, configurada pelo backend do Django"""
+        self.connection = None
+        super(DatabaseWrapper, self)._cursor()
+        connection, self.connection = self.connection, None
+        return connection
+
+    def _cursor(self):
+        if self.connection is not None and self.released_at is not None:
+            # primeira query de um novo request numa conexao persistente
+            idle = time.time() - self.released_at
+            self.released_at = None
+            if (self.connection.closed or idle > self.check_after
+                    and not is_usable(self.connection)):
+                close_quietly(self.connection)
+                self.connection = None
+
+        if self.connection is None:
+            if self.pool is not None:
+                self.connection = self.pool.get(self.connect)
+                self.connection.set_isolation_level(self.isolation_level)
+            else:
+                self.connected_at = time.time()
+        return super(DatabaseWrapper, self)._cursor()
+
+    def release(self):
+        """Fim do request: devolve ou mantem a conexao em vez de fecha-la"""
+        if self.connection is None:
+            return
+        if self.pool is not None:
+            connection, self.connection = self.connection, None
+            self.pool.put(connection)
+        elif (self.max_age and not self.connection.closed
+                and time.time() - self.connected_at < self.max_age):
+            try:
+                # nao deixa a conexao parada com uma transacao aberta
+                self.connection.rollback()
+                self.released_at = time.time()
+            except DatabaseError:
+                self.close()
+        else:
+            self.close()
+
+    def close(self):
+        if self.pool is not None and self.connection is not None:
+            connection, self.connection = self.connection, None
+            close_quietly(connection)
+            self.pool.put(connection)
+            return
+        self.released_at = None
+        super(DatabaseWrapper, self).close()
+
+
+def release_connections(**kwargs):
+    """No lugar do close_connection: desfaz a transacao e devolve as conexoes"""
+    for alias in connections:
+        connection = connections[alias]
+        connection.abort()
+        getattr(connection, 'release', connection.close)()
+
+
+ENGINE = __name__.rsplit('.', 1)[0]
+
+# o Django fecha todas as conexoes ao fim de cada request; a troca so vale
+# com este backend nos settings, nao a cada import do modulo
+if any(db.get('ENGINE') == ENGINE for db in settings.DATABASES.values()):
+    signals.request_finished.disconnect(close_connection)
+    signals.request_finished.connect(release_connections)
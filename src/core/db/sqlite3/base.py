@@ -0,0 +1,32 @@
+# coding: utf-8
+
+from django.db.backends.sqlite3 import base
+
+DatabaseError = base.DatabaseError
+IntegrityError = base.IntegrityError
+
+# WAL deixa leituras e a escrita andarem juntas; com synchronous NORMAL o
+# fsync fica so no checkpoint, e o busy_timeout (ms) faz a escrita esperar
+# pelo lock em vez de falhar com "database is locked".
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),
+    ('mmap_size', 64 * 1024 * 1024),
+    ('cache_size', -16000),
+)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite para muitos requests simultaneos: cada conexao nova recebe os
+    PRAGMAS acima, que podem ser trocados pela chave PRAGMAS do banco.
+    """
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.pragmas = self.settings_dict.get('PRAGMAS', PRAGMAS)
+
+    def _sqlite_create_connection(self):
+        super(DatabaseWrapper, self)._sqlite_create_connection()
+        for name, value in self.pragmas:
+            self.connection.execute('PRAGMA %s = %s' % (name, value))
@@ -0,0 +1,49 @@
+# coding: utf-8
+
+from collections import OrderedDict
+from threading import Lock
+from django.template import Context, Template
+
+
+class EmbedRenderer(object):
+    """
+    Renderiza o html de um embed compilando o template uma unica vez e
+    mantendo um cache LRU do html gerado.
+    """
+    def __init__(self, source, maxsize=256):
+        self.source = source
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._template = None
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def template(self):
+        if self._template is None:
+            self._template = Template(self.source)
+        return self._template
+
+    def render(self, autoescape=True, **params):
+        key = (tuple(sorted(params.items())), autoescape)
+        with self._lock:
+            html = self._cache.pop(key, None)
+            if html is not None:
+                self.hits += 1
+                self._cache[key] = html
+                return html
+            self.misses += 1
+
+        html = self.template.render(Context(params, autoescape=autoescape))
+
+        with self._lock:
+            self._cache[key] = html
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+from datetime import time
+from optparse import make_option
+from timeit import default_timer
+from django.core.management.base import BaseCommand
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from src.core.compression import ENCODINGS, compress_all
+from src.core.middleware import CompressionMiddleware
+from src.core.models import Speaker, Talk, Media
+from src.core.prerender import render_page
+
+
+class Command(BaseCommand):
+    help = (u'Mede, para cada pagina publica, os bytes economizados por '
+            u'brotli e gzip e o tempo de CPU da compressao a cada request '
+            u'contra o corpo ja comprimido guardado no cache.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--talks', type='int', default=40,
+            help=u'Palestras sinteticas, cada uma com slides e video.'),
+        make_option('--repeat', type='int', default=50,
+            help=u'Compressoes medidas por pagina e codificacao.'),
+    )
+
+    def handle(self, *args, **options):
+        last_talk, last_speaker = self.load(options['talks'])
+        try:
+            talk = Talk.objects.filter(pk__gt=last_talk).order_by('pk')[0]
+            speaker = Speaker.objects.filter(pk__gt=last_speaker).order_by('pk')[0]
+            pages = [
+                ('homepage', reverse('homepage')),
+                ('core:talks', reverse('core:talks')),
+                ('core:talk_detail', reverse('core:talk_detail', args=[talk.pk])),
+                ('core:speaker_detail', reverse('core:speaker_detail',
+                                                kwargs={'slug': speaker.slug})),
+                ('core:talks_by_speaker', reverse('core:talks_by_speaker',
+                                                  kwargs={'slug': speaker.slug})),
+            ]
+            for name, path in pages:
+                self.measure(name, path, options['repeat'])
+        finally:
+            Talk.objects.filter(pk__gt=last_talk).delete()
+            Speaker.objects.filter(pk__gt=last_speaker).delete()
+            transaction.commit_unless_managed()
+
+    def last_pk(self, model):
+        last = model.objects.order_by('-pk')[:1]
+        return last and last[0].pk or 0
+
+    def load(self, talks):
+        last_talk, last_speaker = self.last_pk(Talk), self.last_pk(Speaker)
+        Speaker.objects.bulk_create([
+            Speaker(name=u'Palestrante %d' % i, slug=u'bench-speaker-%d' % i,
+                    url=u'http://example.com/%d' % i,
+                    description=u'Desenvolvedor Python ha %d anos.' % i)
+            for i in xrange(last_speaker, last_speaker + max(talks / 2, 1))])
+        speaker_ids = list(Speaker.objects.filter(pk__gt=last_speaker)
+                           .values_list('pk', flat=True))
+
+        Talk.objects.bulk_create([
+            Talk(title=u'Palestra %d' % i, start_time=time(8 + i % 10, i % 60),
+                 description=u'Descricao da palestra %d sobre Django.' % i)
+            for i in xrange(talks)])
+        talk_ids = list(Talk.objects.filter(pk__gt=last_talk)
+                        .values_list('pk', flat=True))
+
+        Through = Talk.speakers.through
+        Through.objects.bulk_create([
+            Through(talk_id=pk, speaker_id=speaker_ids[i % len(speaker_ids)])
+            for i, pk in enumerate(talk_ids)])
+        Media.objects.bulk_create([
+            Media(talk_id=pk, type=kind, title=u'Media %d' % pk,
+                  media_id=u'QjA5faZF%d' % pk)
+            for pk in talk_ids for kind, name in Media.MEDIAS])
+        transaction.commit_unless_managed()
+        return last_talk, last_speaker
+
+    def timed(self, request, content, bodies, repeat):
+        """Tempo medio do middleware por resposta"""
+        middleware = CompressionMiddleware()
+        start = default_timer()
+        for i in xrange(repeat):
+            response = HttpResponse(content)
+            if bodies is not None:
+                response.compressed = bodies
+            middleware.process_response(request, response)
+        return (default_timer() - start) / repeat
+
+    def measure(self, name, path, repeat):
+        content = render_page(path).content
+        # corpos guardados pelo anonymous_cache junto da pagina
+        bodies = compress_all(content)
+
+        for encoding in ENCODINGS:
+            request = RequestFactory().get(path, HTTP_ACCEPT_ENCODING=encoding)
+            compressing = self.timed(request, content, None, repeat)
+            cached = self.timed(request, content, bodies, repeat)
+            size = len(bodies[encoding])
+            self.stdout.write(
+                u'%-22s %-4s %6d -> %6d bytes (-%4.1f%%), CPU por request: '
+                u'%.3f ms comprimindo, %.3f ms do cache\n' % (
+                    name, encoding, len(content), size,
+                    100.0 * (len(content) - size) / len(content),
+                    compressing * 1000, cached * 1000))
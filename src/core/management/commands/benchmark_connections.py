@@ -0,0 +1,143 @@
+# coding: utf-8
+
+import itertools
+import threading
+from optparse import make_option
+from timeit import default_timer
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.test.client import RequestFactory
+from src.core.db.pool import ConnectionPool
+from src.subscriptions.models import Subscription, OutboxMessage
+
+CSRF_TOKEN = 'benchmark'
+
+
+def valid_cpf(number):
+    digits = map(int, '7%08d' % number)
+    for weights in (range(10, 1, -1), range(11, 1, -1)):
+        rest = sum(w * d for w, d in zip(weights, digits)) % 11
+        digits.append(rest >= 2 and 11 - rest or 0)
+    return ''.join(map(str, digits))
+
+
+class Command(BaseCommand):
+    help = (u'Mede a latencia da grade e da inscricao sob carga fechando a '
+            u'conexao a cada request, com conexoes persistentes e com o '
+            u'pool. Requer o banco com ENGINE src.core.db.postgresql.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--requests', type='int', default=400,
+            help=u'Requests por modo e por view.'),
+        make_option('--threads', type='int', default=8,
+            help=u'Threads fazendo requests ao mesmo tempo.'),
+        make_option('--pool-size', type='int', default=4,
+            help=u'Conexoes no pool do modo pool.'),
+    )
+
+    def handle(self, *args, **options):
+        # so o backend src.core.db.postgresql mantem conexoes entre requests
+        if not hasattr(connections[DEFAULT_DB_ALIAS], 'release'):
+            raise CommandError(u'Configure o PostgreSQL pelas variaveis '
+                               u'DATABASE_* (ENGINE src.core.db.postgresql).')
+        self.prepare()
+        try:
+            for mode in ('close', 'persistent', 'pool'):
+                pool = None
+                if mode == 'pool':
+                    pool = ConnectionPool(size=options['pool_size'])
+                for view in ('core:talks', 'subscriptions:subscribe'):
+                    latencies, elapsed = self.measure(
+                        mode, pool, view, options['requests'], options['threads'])
+                    self.report(mode, view, latencies, elapsed)
+                if pool is not None:
+                    pool.close_all()
+        finally:
+            self.cleanup()
+
+    def last_pk(self, model):
+        last = model.objects.order_by('-pk')[:1]
+        return last and last[0].pk or 0
+
+    def prepare(self):
+        self.handler = WSGIHandler()
+        self.cpfs = itertools.count()
+        self.emails = []
+        # a limpeza so apaga o que foi criado depois daqui com esses emails
+        self.last_subscription = self.last_pk(Subscription)
+        self.last_outbox = self.last_pk(OutboxMessage)
+
+    def cleanup(self):
+        """Apaga as inscricoes feitas pelo benchmark e os emails delas"""
+        for start in xrange(0, len(self.emails), 500):
+            emails = self.emails[start:start + 500]
+            OutboxMessage.objects.filter(
+                pk__gt=self.last_outbox, recipient__in=emails).delete()
+            # a remocao passa pelo post_delete, que desconta os dias
+            Subscription.objects.filter(
+                pk__gt=self.last_subscription, email__in=emails).delete()
+        transaction.commit_unless_managed()
+
+    def environ(self, view):
+        factory = RequestFactory()
+        path = reverse(view)
+        number = self.cpfs.next()
+        if view == 'core:talks':
+            # um caminho por request: o anonymous_cache nunca tem a pagina
+            # pronta e cada leitura chega ao banco
+            return factory.get(path, {'request': number}).environ
+        email = u'carga%d@example.com' % number
+        self.emails.append(email)
+        return factory.post(path, {
+            'name': u'Inscrito %d' % number,
+            'cpf': valid_cpf(number),
+            'email': email,
+            'phone_0': u'21', 'phone_1': u'12345678',
+            'csrfmiddlewaretoken': CSRF_TOKEN,
+        }, HTTP_COOKIE='csrftoken=%s' % CSRF_TOKEN).environ
+
+    def request(self, view):
+        """Um request completo, com os sinais de inicio e fim do request"""
+        start = default_timer()
+        response = self.handler(self.environ(view), lambda status, headers: None)
+        ''.join(response)
+        response.close()
+        return default_timer() - start
+
+    def measure(self, mode, pool, view, requests, threads):
+        latencies = []
+
+        def worker(count):
+            # cada thread tem o seu DatabaseWrapper
+            connection = connections[DEFAULT_DB_ALIAS]
+            connection.max_age = mode == 'persistent' and 600 or 0
+            connection.pool = pool
+            try:
+                for i in xrange(count):
+                    latencies.append(self.request(view))
+            finally:
+                connection.close()
+                connection.pool = None
+
+        start = default_timer()
+        workers = [threading.Thread(target=worker, args=(requests / threads,))
+                   for i in xrange(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return latencies, default_timer() - start
+
+    def report(self, mode, view, latencies, elapsed):
+        latencies.sort()
+        def pick(p):
+            if not latencies:
+                return 0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+        self.stdout.write(
+            u'%-10s %-24s %.2fs: %d requests, %.0f req/s, p50 %.1fms, '
+            u'p99 %.1fms, max %.1fms\n' % (
+                mode, view, elapsed, len(latencies),
+                len(latencies) / elapsed, pick(0.5), pick(0.99), pick(1)))
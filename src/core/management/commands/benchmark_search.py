@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import random
+from datetime import time
+from optparse import make_option
+from timeit import default_timer
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from src.core.models import Speaker, Talk
+from src.core.search import SearchIndex
+
+WORDS = (u'python django programação análise dados técnicas ágeis testes '
+         u'automação segurança aplicações distribuídas concorrência banco '
+         u'migração performance memória otimização introdução prática '
+         u'avançado código refatoração serviços nuvem máquinas aprendizado '
+         u'visualização comunicação gestão equipes inovação educação').split()
+QUERIES = (u'django', u'programacao python', u'análise de dados',
+           u'seguranca aplicacoes', u'nuvem', u'refatoração código legado')
+
+
+class Command(BaseCommand):
+    help = (u'Compara a busca no indice invertido em memoria com icontains '
+            u'no ORM sobre palestras e palestrantes sinteticos.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--talks', type='int', default=5000,
+            help=u'Palestras sinteticas.'),
+        make_option('--speakers', type='int', default=1000,
+            help=u'Palestrantes sinteticos.'),
+        make_option('--repeat', type='int', default=20,
+            help=u'Repeticoes de cada busca.'),
+    )
+
+    def handle(self, *args, **options):
+        last_talk, last_speaker = self.load(options['talks'], options['speakers'])
+        try:
+            index = SearchIndex()
+            start = default_timer()
+            index.ensure_loaded()
+            self.stdout.write(u'indice montado em %.1f ms com %d documentos\n' % (
+                (default_timer() - start) * 1000, len(index.documents)))
+
+            for query in QUERIES:
+                indexed = self.timed(lambda: index.search(query), options['repeat'])
+                orm = self.timed(lambda: self.orm_search(query), options['repeat'])
+                self.stdout.write(
+                    u'%-28s indice %7.3f ms (%3d)  orm %7.3f ms (%3d)\n' % (
+                        query, indexed[0] * 1000, len(indexed[1]),
+                        orm[0] * 1000, len(orm[1])))
+        finally:
+            Talk.objects.filter(pk__gt=last_talk).delete()
+            Speaker.objects.filter(pk__gt=last_speaker).delete()
+            transaction.commit_unless_managed()
+
+    def timed(self, func, repeat):
+        start = default_timer()
+        for i in xrange(repeat):
+            result = func()
+        return (default_timer() - start) / repeat, result
+
+    def orm_search(self, query):
+        """Abordagem ingenua: icontains de cada palavra, sem ranking nem acentos"""
+        talks, speakers = Talk.objects.all(), Speaker.objects.all()
+        for word in query.split():
+            talks = talks.filter(Q(title__icontains=word) |
+                                 Q(description__icontains=word))
+            speakers = speakers.filter(Q(name__icontains=word) |
+                                       Q(description__icontains=word))
+        return list(talks.values_list('pk')[:20]) + list(speakers.values_list('pk')[:20])
+
+    def last_pk(self, model):
+        last = model.objects.order_by('-pk')[:1]
+        return last and last[0].pk or 0
+
+    def text(self, rng, words):
+        # um vocabulario maior que WORDS, como em descricoes reais
+        return u' '.join(
+            rng.random() < 0.1 and rng.choice(WORDS) or u'termo%d' % rng.randint(1, 5000)
+            for i in xrange(words))
+
+    def load(self, talks, speakers):
+        rng = random.Random(42)
+        last_talk, last_speaker = self.last_pk(Talk), self.last_pk(Speaker)
+        # bulk_create nao dispara sinais; o indice e montado depois
+        Speaker.objects.bulk_create([
+            Speaker(name=u'Palestrante %d' % i, slug=u'bench-search-%d' % i,
+                    url=u'http://example.com/%d' % i, description=self.text(rng, 30))
+            for i in xrange(last_speaker, last_speaker + speakers)])
+        Talk.objects.bulk_create([
+            Talk(title=self.text(rng, 5), description=self.text(rng, 60),
+                 start_time=time(8 + i % 10))
+            for i in xrange(talks)])
+        transaction.commit_unless_managed()
+        return last_talk, last_speaker
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+import sys
+import threading
+from optparse import make_option
+from timeit import default_timer
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import got_request_exception
+from django.db import connections, DEFAULT_DB_ALIAS
+from src.core.db.sqlite3.base import PRAGMAS
+from .benchmark_connections import Command as ConnectionsCommand
+
+# o que o Django faz sem configuracao: rollback journal e o timeout de 5s
+# do pysqlite
+STOCK = (('journal_mode', 'DELETE'),)
+
+
+class Command(ConnectionsCommand):
+    help = (u'Dispara inscricoes e leituras da grade em paralelo com o SQLite '
+            u'padrao e com WAL e os pragmas de src.core.db.sqlite3, medindo '
+            u'vazao e erros de "database is locked". Requer o banco em '
+            u'arquivo com ENGINE src.core.db.sqlite3 (SQLITE_TUNED=True).')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--requests', type='int', default=200,
+            help=u'Requests por modo e por view.'),
+        make_option('--threads', type='int', default=8,
+            help=u'Threads por view fazendo requests ao mesmo tempo.'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if not hasattr(connection, 'pragmas'):
+            raise CommandError(u'Use SQLITE_TUNED=True (ENGINE src.core.db.sqlite3).')
+        if connection.settings_dict['NAME'] == ':memory:':
+            raise CommandError(u'O banco em memoria nao tem concorrencia entre conexoes.')
+        self.prepare()
+        # o sinal de erro chega na thread que atendeu o request
+        self.failure = threading.local()
+        got_request_exception.connect(self.request_failed)
+        try:
+            for mode, pragmas in (('stock', STOCK), ('tuned', PRAGMAS)):
+                # journal_mode fica gravado no arquivo; troca sem outras conexoes
+                connection.close()
+                connection.pragmas = pragmas
+                connection.cursor()
+                self.run(mode, pragmas, options['requests'], options['threads'])
+        finally:
+            got_request_exception.disconnect(self.request_failed)
+            connection.close()
+            connection.pragmas = PRAGMAS
+            self.cleanup()
+
+    def request_failed(self, sender, **kwargs):
+        self.failure.error = sys.exc_info()[1]
+
+    def run(self, mode, pragmas, requests, threads):
+        views = ('core:talks', 'subscriptions:subscribe')
+        latencies = dict((view, []) for view in views)
+        locked = dict((view, 0) for view in views)
+        failed = dict((view, 0) for view in views)
+        lock = threading.Lock()
+
+        def worker(view, count):
+            connection = connections[DEFAULT_DB_ALIAS]
+            connection.pragmas = pragmas
+            try:
+                for i in xrange(count):
+                    self.failure.error = None
+                    latency = self.request(view)
+                    error = self.failure.error
+                    with lock:
+                        latencies[view].append(latency)
+                        if error is not None:
+                            failed[view] += 1
+                            locked[view] += 'locked' in unicode(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=worker, args=(view, requests / threads))
+                   for view in views for i in xrange(threads)]
+        start = default_timer()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = default_timer() - start
+        for view in views:
+            self.report(mode, view, latencies[view], elapsed)
+            self.stdout.write(u'%-10s %-24s %d erros, %d de "database is locked"\n'
+                              % ('', '', failed[view], locked[view]))
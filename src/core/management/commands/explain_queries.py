@@ -0,0 +1,179 @@
+# coding: utf-8
+
+from datetime import time, timedelta
+from optparse import make_option
+from timeit import default_timer
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from src.core.models import Speaker, Contact, Talk, Media
+from src.subscriptions.models import Subscription, DailySubscriptionCount, count_by_day
+
+
+class Command(BaseCommand):
+    help = (u'Carrega dados sinteticos, roda EXPLAIN nas queries dos managers '
+            u'e views e falha se alguma fizer full table scan. Os dados sao '
+            u'removidos ao final.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', default=DEFAULT_DB_ALIAS,
+            help=u'Banco onde as queries serao analisadas.'),
+        make_option('--talks', type='int', default=2000,
+            help=u'Quantidade de palestras sinteticas.'),
+        make_option('--subscriptions', type='int', default=20000,
+            help=u'Quantidade de inscricoes sinteticas.'),
+    )
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        vendor = connection.vendor
+        if vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(u'Banco nao suportado: %s' % vendor)
+
+        # O sqlite do python faz commit implicito antes de um EXPLAIN, entao
+        # os dados sinteticos sao removidos ao final em vez de rollback.
+        last_pks = self.load(
+            using, options['talks'], options['subscriptions'])
+        try:
+            cursor = connection.cursor()
+            if vendor == 'postgresql':
+                # sem seq scan o planner so volta a ele se nao houver
+                # indice que atenda a query
+                cursor.execute('ANALYZE')
+                cursor.execute('SET enable_seqscan = off')
+
+            scans = []
+            for name, qs in self.queries(using):
+                plan, elapsed = self.explain(cursor, vendor, qs)
+                full_scan = [line for line in plan
+                             if self.is_full_scan(vendor, line)]
+                self.stdout.write(u'%s %s (%.2f ms)\n' % (
+                    full_scan and 'FAIL' or 'OK  ', name, elapsed * 1000))
+                for line in plan:
+                    self.stdout.write(u'    %s\n' % line)
+                if full_scan:
+                    scans.append(name)
+
+            if vendor == 'postgresql':
+                cursor.execute('RESET enable_seqscan')
+        finally:
+            self.unload(using, last_pks)
+            transaction.commit_unless_managed(using)
+
+        if scans:
+            raise CommandError(
+                u'Full table scan em: %s' % u', '.join(scans))
+
+    def last_pk(self, model, using):
+        last = model.objects.db_manager(using).order_by('-pk')[:1]
+        return last and last[0].pk or 0
+
+    def load(self, using, talks, subscriptions):
+        speakers = max(talks / 2, 1)
+        last_speaker = self.last_pk(Speaker, using)
+        last_talk = self.last_pk(Talk, using)
+        last_subscription = self.last_pk(Subscription, using)
+        Speaker.objects.db_manager(using).bulk_create([
+            Speaker(name=u'Speaker %d' % i, slug=u'speaker-%d' % i,
+                    url=u'http://example.com/%d' % i)
+            for i in xrange(last_speaker, last_speaker + speakers)])
+        speaker_ids = list(Speaker.objects.db_manager(using)
+            .filter(pk__gt=last_speaker).values_list('pk', flat=True))
+
+        Contact.objects.db_manager(using).bulk_create([
+            Contact(speaker_id=pk, kind=kind, value=u'12-34567890')
+            for pk in speaker_ids for kind, name in Contact.KINDS])
+
+        Talk.objects.db_manager(using).bulk_create([
+            Talk(title=u'Talk %d' % i, description=u'',
+                 start_time=time(8 + i % 10, i % 60))
+            for i in xrange(talks)])
+        talk_ids = list(Talk.objects.db_manager(using)
+            .filter(pk__gt=last_talk).values_list('pk', flat=True))
+
+        Through = Talk.speakers.through
+        Through.objects.db_manager(using).bulk_create([
+            Through(talk_id=pk, speaker_id=speaker_ids[i % len(speaker_ids)])
+            for i, pk in enumerate(talk_ids)])
+
+        Media.objects.db_manager(using).bulk_create([
+            Media(talk_id=pk, type=kind, title=u'Media', media_id=u'%d' % pk)
+            for pk in talk_ids for kind, name in Media.MEDIAS])
+
+        synthetic = [
+            Subscription(name=u'Inscrito %d' % i, cpf=u'9%010d' % i,
+                         email=u'inscrito%d@example.com' % i,
+                         phone=u'12-34567890')
+            for i in xrange(last_subscription, last_subscription + subscriptions)]
+        Subscription.objects.db_manager(using).bulk_create(synthetic)
+        # a remocao ao final passa pelo post_delete, que desconta os dias
+        DailySubscriptionCount.objects.db_manager(using).add(
+            count_by_day((s.created_at, s.paid) for s in synthetic))
+
+        return last_speaker, last_talk, last_subscription
+
+    def unload(self, using, last_pks):
+        for model, last in zip((Speaker, Talk, Subscription), last_pks):
+            model.objects.db_manager(using).filter(pk__gt=last).delete()
+
+    def queries(self, using):
+        talk = Talk.objects.db_manager(using).order_by('pk')[0]
+        talk_ids = [talk.pk]
+        speaker = Speaker.objects.db_manager(using).order_by('pk')[0]
+        today = timezone.now()
+
+        return [
+            ('Talk.objects.at_morning',
+                Talk.objects.db_manager(using).at_morning()),
+            ('Talk.objects.at_afternoon',
+                Talk.objects.db_manager(using).at_afternoon()),
+            ('Talk.objects.schedule (speakers)',
+                Speaker.objects.db_manager(using).filter(talk__in=talk_ids)),
+            ('Talk.objects.schedule (medias)',
+                Media.objects.db_manager(using).filter(talk__in=talk_ids)),
+            ('Media (talk, type)',
+                Media.objects.db_manager(using).filter(talk=talk, type='SL')),
+            ('Contact.phones',
+                Contact.phones.db_manager(using).filter(speaker=speaker)),
+            ('Speaker.contacts',
+                Contact.objects.db_manager(using).filter(speaker=speaker)),
+            ('core.views.speaker_detail',
+                Speaker.objects.db_manager(using).filter(slug=speaker.slug)),
+            ('core.views.talk_detail',
+                Talk.objects.db_manager(using).filter(pk=talk.pk)),
+            ('core.views.talks_by_speaker',
+                Talk.objects.db_manager(using).by_speaker(speaker.slug)),
+            ('Subscription date_hierarchy',
+                Subscription.objects.db_manager(using).filter(
+                    created_at__gte=today - timedelta(days=1),
+                    created_at__lt=today)),
+            ('Subscription ordering',
+                Subscription.objects.db_manager(using).all()[:100]),
+            ('SubscriptionForm email',
+                Subscription.objects.db_manager(using).filter(
+                    email=u'inscrito1@example.com')),
+            ('SubscriptionForm cpf',
+                Subscription.objects.db_manager(using).filter(cpf=u'90000000001')),
+        ]
+
+    def explain(self, cursor, vendor, qs):
+        sql, params = qs.query.get_compiler(qs.db).as_sql()
+
+        start = default_timer()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        elapsed = default_timer() - start
+
+        if vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = [row[0] for row in cursor.fetchall()]
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+        return plan, elapsed
+
+    def is_full_scan(self, vendor, line):
+        if vendor == 'postgresql':
+            return 'Seq Scan' in line
+        return line.startswith('SCAN') and 'INDEX' not in line
@@ -0,0 +1,33 @@
+# coding: utf-8
+
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from src.core.prerender import prerender
+
+
+class Command(BaseCommand):
+    help = (u'Gera o HTML estatico da homepage, da grade, das palestras e dos '
+            u'palestrantes. Por padrao so refaz as paginas afetadas pelo que '
+            u'mudou desde a ultima execucao.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='full', default=False,
+            help=u'Gera todas as paginas novamente.'),
+        make_option('--root', default=None,
+            help=u'Pasta de destino, por padrao PRERENDER_ROOT.'),
+    )
+
+    def handle(self, *args, **options):
+        root = options['root'] or settings.PRERENDER_ROOT
+        rendered, removed, failed = prerender(root, full=options['full'])
+
+        for path in rendered:
+            self.stdout.write(u'Gerada %s\n' % path)
+        for path in removed:
+            self.stdout.write(u'Removida %s\n' % path)
+        self.stdout.write(u'%d paginas geradas e %d removidas em %s\n' % (
+            len(rendered), len(removed), root))
+
+        if failed:
+            raise CommandError(u'Falha ao gerar: %s' % u', '.join(failed))
@@ -0,0 +1,35 @@
+# coding: utf-8
+
+from django.utils.cache import patch_vary_headers
+from .compression import compress, compressible, negotiate
+
+
+class CompressionMiddleware(object):
+    """
+    Comprime as respostas com brotli ou gzip, conforme o Accept-Encoding.
+    Respostas vindas do anonymous_cache ja trazem os corpos comprimidos em
+    response.compressed e nao sao comprimidas de novo.
+    """
+    def process_response(self, request, response):
+        if not compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        body = getattr(response, 'compressed', {}).get(encoding)
+        if body is None:
+            body = compress(encoding, response.content)
+        if len(body) >= len(response.content):
+            return response
+
+        response.content = body
+        response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(body))
+        # o corpo muda com a codificacao
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response['ETag'] = 'W/' + etag
+        return response
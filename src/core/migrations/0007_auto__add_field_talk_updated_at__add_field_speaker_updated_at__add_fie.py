@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+from django.utils import timezone
+
+
+# No SQLite o South recria a tabela para adicionar ou remover colunas e
+# perde os indices que nao sao unicos; eles sao recriados em seguida.
+SQLITE_INDEXES = (
+    ('core_speaker', ['slug']),
+    ('core_talk', ['start_time']),
+    ('core_media', ['talk_id']),
+    ('core_media', ['talk_id', 'type']),
+)
+
+
+def recreate_sqlite_indexes():
+    if db.backend_name == 'sqlite3':
+        for table, columns in SQLITE_INDEXES:
+            db.create_index(table, columns)
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Talk.updated_at'
+        db.add_column('core_talk', 'updated_at',
+                      self.gf('django.db.models.fields.DateTimeField')(auto_now=True, default=timezone.now(), db_index=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Speaker.updated_at'
+        db.add_column('core_speaker', 'updated_at',
+                      self.gf('django.db.models.fields.DateTimeField')(auto_now=True, default=timezone.now(), db_index=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'Media.updated_at'
+        db.add_column('core_media', 'updated_at',
+                      self.gf('django.db.models.fields.DateTimeField')(auto_now=True, default=timezone.now(), db_index=True, blank=True),
+                      keep_default=False)
+
+        recreate_sqlite_indexes()
+
+
+    def backwards(self, orm):
+        # Deleting field 'Talk.updated_at'
+        db.delete_column('core_talk', 'updated_at')
+
+        # Deleting field 'Speaker.updated_at'
+        db.delete_column('core_speaker', 'updated_at')
+
+        # Deleting field 'Media.updated_at'
+        db.delete_column('core_media', 'updated_at')
+
+        recreate_sqlite_indexes()
+
+
+    models = {
+        'core.contact': {
+            'Meta': {'object_name': 'Contact'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            'speaker': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['core.Speaker']"}),
+            'value': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'core.course': {
+            'Meta': {'object_name': 'Course', '_ormbases': ['core.Talk']},
+            'notes': ('django.db.models.fields.TextField', [], {}),
+            'slots': ('django.db.models.fields.IntegerField', [], {}),
+            'talk_ptr': ('django.db.models.fields.related.OneToOneField', [], {'to': "orm['core.Talk']", 'unique': 'True', 'primary_key': 'True'})
+        },
+        'core.media': {
+            'Meta': {'object_name': 'Media'},
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'media_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'talk': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['core.Talk']"}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '2'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        },
+        'core.speaker': {
+            'Meta': {'object_name': 'Speaker'},
+            'avatar': ('django.db.models.fields.files.FileField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            'description': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'slug': ('django.db.models.fields.SlugField', [], {'max_length': '50'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'url': ('django.db.models.fields.URLField', [], {'max_length': '200'})
+        },
+        'core.talk': {
+            'Meta': {'object_name': 'Talk'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'speakers': ('django.db.models.fields.related.ManyToManyField', [], {'to': "orm['core.Speaker']", 'symmetrical': 'False'}),
+            'start_time': ('django.db.models.fields.TimeField', [], {'db_index': 'True', 'blank': 'True'}),
+            'title': ('django.db.models.fields.CharField', [], {'max_length': '200'}),
+            'updated_at': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['core']
\ No newline at end of file
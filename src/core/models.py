@@ -1,13 +1,65 @@
 # coding: utf-8
 
 from django.db import models
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from datetime import time
+from collections import namedtuple
+from .cache import get_versions, bump_versions, bump_site_version, after_commit
+from .thumbnails import avatar_variants, AVATAR_DISPLAY_WIDTH
+from .search import index as search_index
+
+
+class GroupedRelation(object):
+    """
+    Objetos de uma relacao reversa agrupados pelo campo field, com uma lista
+    para cada escolha do campo, carregados uma unica vez por instancia.
+    forget(obj) descarta o agrupamento do dono de obj quando obj e salvo
+    ou apagado.
+    """
+    def __init__(self, related, field):
+        self.related = related
+        self.field = field
+
+    def contribute_to_class(self, cls, name):
+        self.model = cls
+        self.cache_name = '_%s' % name
+        setattr(cls, name, self)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        if self.cache_name not in instance.__dict__:
+            manager = getattr(instance, self.related)
+            choices = manager.model._meta.get_field(self.field).choices
+            groups = dict((kind, []) for kind, name in choices)
+            for obj in manager.all():
+                groups.setdefault(getattr(obj, self.field), []).append(obj)
+            instance.__dict__[self.cache_name] = groups
+        return instance.__dict__[self.cache_name]
+
+    def forget(self, obj):
+        fk = getattr(self.model, self.related).related.field
+        # so o dono ja carregado em obj pode ter o agrupamento em memoria
+        instance = getattr(obj, fk.get_cache_name(), None)
+        if instance is not None:
+            instance.__dict__.pop(self.cache_name, None)
+            prefetched = getattr(instance, '_prefetched_objects_cache', {})
+            prefetched.pop(fk.related_query_name(), None)
+
+
+class SpeakerManager(models.Manager):
+    """Manager de palestrantes"""
+    def with_contacts(self):
+        """Carrega os contatos de todos os palestrantes em uma unica query"""
+        return self.prefetch_related('contact_set')
 
 
 class Speaker(models.Model):
     name = models.CharField(_('Nome'), max_length=255)
-    slug = models.SlugField(_('Slug'))
+    slug = models.SlugField(_('Slug'), unique=True)
     url = models.URLField(_('Url'))
     description = models.TextField(_(u'Descrição'), blank=True)
     avatar = models.FileField(
@@ -15,10 +67,34 @@ class Speaker(models.Model):
         upload_to='palestrantes',
         blank=True,
         null=True)
+    updated_at = models.DateTimeField(_('Alterado em'), auto_now=True, db_index=True)
+
+    objects = SpeakerManager()
+    contacts = GroupedRelation('contact_set', 'kind')
 
     def __unicode__(self):
         return self.name
 
+    @property
+    def avatar_variants(self):
+        """(largura, url) das miniaturas do avatar"""
+        if not hasattr(self, '_avatar_variants'):
+            self._avatar_variants = avatar_variants(self.avatar)
+        return self._avatar_variants
+
+    @property
+    def avatar_srcset(self):
+        return ', '.join('%s %dw' % (url, width)
+                         for width, url in self.avatar_variants)
+
+    @property
+    def avatar_thumbnail(self):
+        """Miniatura usada no src, o original se nao houver variantes"""
+        for width, url in self.avatar_variants:
+            if width >= AVATAR_DISPLAY_WIDTH:
+                return url
+        return self.avatar.url
+
 
 class KindContactManager(models.Manager):
     """Classe especializada por tipos"""
@@ -50,9 +126,18 @@ class Contact(models.Model):
     faxes = KindContactManager('F')
 
 
+Schedule = namedtuple('Schedule', 'morning afternoon queries')
+
+
 class PeriodManager(models.Manager):
     """Manager para mornings e afternoons talks"""
     midday = time(12)
+    schedule_related = ('speakers', 'media_set')
+
+    def __init__(self, schedule_select=()):
+        super(PeriodManager, self).__init__()
+        # relacoes 1-1 trazidas no mesmo join da grade
+        self.schedule_select = schedule_select
 
     def at_morning(self):
         qs = self.filter(start_time__lt=self.midday)
@@ -64,26 +149,95 @@ class PeriodManager(models.Manager):
         qs = qs.order_by('start_time')
         return qs
 
+    def schedule(self):
+        """
+        Carrega a grade completa com palestrantes e medias em um numero
+        fixo de queries e separa manha e tarde em Python. Informa em
+        queries quantas consultas foram feitas.
+        """
+        qs = self.order_by('start_time')
+        qs = qs.select_related(*self.schedule_select)
+        qs = qs.prefetch_related(*self.schedule_related)
+
+        talks = list(qs)
+        # sem palestras o prefetch nao consulta o banco
+        queries = 1 + len(self.schedule_related) if talks else 1
+
+        morning, afternoon = [], []
+        for talk in talks:
+            if talk.start_time is None:
+                continue
+            if talk.start_time < self.midday:
+                morning.append(talk)
+            else:
+                afternoon.append(talk)
+
+        attach_cache_versions(morning + afternoon)
+        return Schedule(morning, afternoon, queries)
+
+    def with_medias(self):
+        """Carrega as medias de todas as palestras em uma unica query"""
+        return self.prefetch_related('media_set')
+
+    def by_speaker(self, slug):
+        """Palestras do palestrante em um join pelo slug, com os co-palestrantes e medias"""
+        qs = self.filter(speakers__slug=slug).order_by('start_time')
+        qs = qs.select_related(*self.schedule_select)
+        return qs.prefetch_related(*self.schedule_related)
+
 
 class Talk(models.Model):
     """Classe que representa tabela Talk"""
+    TALK = 'T'
+    COURSE = 'C'
+    KINDS = (
+        (TALK, _('Palestra')),
+        (COURSE, _('Curso')),
+        )
+
     title = models.CharField(max_length=200)
     description = models.TextField()
-    start_time = models.TimeField(blank=True)
+    start_time = models.TimeField(blank=True, db_index=True)
     speakers = models.ManyToManyField('Speaker', verbose_name=_('palestrante'))
+    updated_at = models.DateTimeField(_('Alterado em'), auto_now=True, db_index=True)
+    kind = models.CharField(_('Tipo'), max_length=1, choices=KINDS,
+                            default=TALK, editable=False)
 
-    objects = PeriodManager()
+    objects = PeriodManager(schedule_select=('course',))
+    medias = GroupedRelation('media_set', 'type')
 
     def __unicode__(self):
         return self.title
 
+    @property
+    def is_course(self):
+        return self.kind == self.COURSE
+
+    @property
+    def as_course(self):
+        """
+        O Course desta palestra ou None. Palestras nao consultam o banco, e
+        na grade o curso ja vem no join.
+        """
+        if not self.is_course:
+            return None
+        return self.course
+
+    @property
+    def cache_version(self):
+        """Versao do fragmento em cache, trocada a cada alteracao"""
+        if not hasattr(self, '_cache_version'):
+            attach_cache_versions([self])
+        return self._cache_version
+
     @property
     def slides(self):
-        return self.media_set.filter(type='SL')
+        return self.medias['SL']
 
     @property
     def videos(self):
-        return self.media_set.filter(type='YT')
+        return self.medias['YT']
+
 
 class Course(Talk):
     """Classe que representa um Course"""
@@ -92,6 +246,10 @@ class Course(Talk):
 
     objects = PeriodManager()
 
+    def save(self, *args, **kwargs):
+        self.kind = Talk.COURSE
+        super(Course, self).save(*args, **kwargs)
+
 
 class Media(models.Model):
     """Classe que representa as Medias de um Course"""
@@ -104,6 +262,113 @@ class Media(models.Model):
     type = models.CharField(max_length=2, choices=MEDIAS)
     title = models.CharField(u'Título', max_length=255)
     media_id = models.CharField(max_length=255)
+    updated_at = models.DateTimeField(_('Alterado em'), auto_now=True, db_index=True)
 
     def __unicode__(self):
         return u'%s - %s' % (self.talk.title, self.title)
+
+
+def attach_cache_versions(talks):
+    versions = get_versions(Talk, [talk.pk for talk in talks])
+    for talk in talks:
+        talk._cache_version = versions[talk.pk]
+
+
+def invalidate_talks(pks, touch=True):
+    """
+    Invalida os fragmentos das palestras e as paginas publicas. Com touch,
+    atualiza updated_at das palestras, usado nos validadores das views.
+    """
+    pks = list(pks)
+    if touch and pks:
+        Talk.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+    bump_versions(Talk, pks)
+    bump_site_version()
+    after_commit(bump_versions, Talk, tuple(sorted(pks)))
+    after_commit(bump_site_version)
+
+
+@receiver(post_save, sender=Talk)
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Talk)
+@receiver(post_delete, sender=Course)
+def invalidate_talk(sender, instance, **kwargs):
+    invalidate_talks([instance.pk], touch=False)
+
+
+@receiver(post_save, sender=Speaker)
+def generate_avatar_variants(sender, instance, raw, **kwargs):
+    # gera as miniaturas no upload, e nao no primeiro visitante
+    if not raw and instance.avatar:
+        instance._avatar_variants = avatar_variants(instance.avatar)
+
+
+@receiver(post_save, sender=Speaker)
+@receiver(pre_delete, sender=Speaker)
+def invalidate_speaker_talks(sender, instance, **kwargs):
+    invalidate_talks(instance.talk_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+def invalidate_media_talk(sender, instance, **kwargs):
+    invalidate_talks([instance.talk_id])
+
+
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def forget_speaker_contacts(sender, instance, **kwargs):
+    Speaker.contacts.forget(instance)
+
+
+@receiver(post_save, sender=Media)
+@receiver(post_delete, sender=Media)
+def forget_talk_medias(sender, instance, **kwargs):
+    Talk.medias.forget(instance)
+
+
+@receiver(m2m_changed, sender=Talk.speakers.through)
+def touch_removed_speakers(sender, instance, action, reverse, pk_set, **kwargs):
+    # a pagina de palestras de quem sai da palestra tambem muda
+    if action not in ('pre_remove', 'pre_clear'):
+        return
+    if reverse:
+        pks = [instance.pk]
+    elif pk_set is not None:
+        pks = list(pk_set)
+    else:
+        pks = list(instance.speakers.values_list('pk', flat=True))
+    Speaker.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Talk.speakers.through)
+def invalidate_talk_speakers(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_talks([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        invalidate_talks(pk_set)
+    elif action == 'pre_clear':
+        invalidate_talks(instance.talk_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Talk)
+@receiver(post_save, sender=Course)
+def index_talk(sender, instance, **kwargs):
+    search_index.update('talk', instance)
+
+
+@receiver(post_delete, sender=Talk)
+@receiver(post_delete, sender=Course)
+def unindex_talk(sender, instance, **kwargs):
+    search_index.remove('talk', instance.pk)
+
+
+@receiver(post_save, sender=Speaker)
+def index_speaker(sender, instance, **kwargs):
+    search_index.update('speaker', instance)
+
+
+@receiver(post_delete, sender=Speaker)
+def unindex_speaker(sender, instance, **kwargs):
+    search_index.remove('speaker', instance.pk)
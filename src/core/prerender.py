@@ -0,0 +1,167 @@
+# coding: utf-8
+
+import json
+import os
+from datetime import timedelta
+from django.contrib.auth.models import AnonymousUser
+from django.core.urlresolvers import reverse, resolve
+from django.test.client import RequestFactory
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from src.core.models import Speaker, Talk, Media
+
+STATE_FILE = '.prerender.json'
+# updated_at e gravado antes do commit: uma transacao aberta no inicio da
+# execucao anterior pode ter deixado alteracoes com data anterior a ela
+MARGIN = timedelta(minutes=1)
+
+
+def talk_page(pk):
+    return reverse('core:talk_detail', args=[pk])
+
+
+def speaker_pages(slug):
+    return [reverse('core:speaker_detail', kwargs={'slug': slug}),
+            reverse('core:talks_by_speaker', kwargs={'slug': slug})]
+
+
+def list_pages():
+    """Paginas que listam palestras"""
+    pages = set([reverse('core:talks')])
+    pages.update(reverse('core:talks_by_speaker', kwargs={'slug': slug})
+                 for slug in Speaker.objects.values_list('slug', flat=True))
+    return pages
+
+
+def site_pages():
+    """Todas as paginas publicas pre-renderizadas"""
+    pages = set([reverse('homepage'), reverse('core:talks')])
+    pages.update(talk_page(pk) for pk in Talk.objects.values_list('pk', flat=True))
+    for slug in Speaker.objects.values_list('slug', flat=True):
+        pages.update(speaker_pages(slug))
+    return pages
+
+
+def pages_for_talks(talks):
+    """A palestra, a grade e as palestras de cada palestrante dela"""
+    pages = set()
+    pks = list(talks.values_list('pk', flat=True))
+    if pks:
+        pages.add(reverse('core:talks'))
+        pages.update(talk_page(pk) for pk in pks)
+        pages.update(reverse('core:talks_by_speaker', kwargs={'slug': slug})
+                     for slug in Speaker.objects.filter(talk__in=pks)
+                     .values_list('slug', flat=True))
+    return pages
+
+
+def pages_for_speakers(speakers):
+    """As paginas do palestrante e as das palestras que mostram o nome dele"""
+    pages = set()
+    for slug in speakers.values_list('slug', flat=True):
+        pages.update(speaker_pages(slug))
+    pages.update(pages_for_talks(Talk.objects.filter(speakers__in=speakers)))
+    return pages
+
+
+def pages_for_medias(medias):
+    """Slides e videos aparecem apenas na pagina da palestra"""
+    return set(talk_page(pk) for pk in
+               medias.values_list('talk', flat=True).distinct())
+
+
+DEPENDENCIES = (
+    (Talk, pages_for_talks),
+    (Speaker, pages_for_speakers),
+    (Media, pages_for_medias),
+)
+
+
+def changed_pages(since):
+    """Paginas afetadas pelos objetos alterados depois de since"""
+    pages = set()
+    for model, dependencies in DEPENDENCIES:
+        pages.update(dependencies(model.objects.filter(updated_at__gt=since)))
+    return pages
+
+
+def render_page(path):
+    """Renderiza o caminho pela view publica, como um visitante anonimo"""
+    match = resolve(path)
+    view = getattr(match.func, 'uncached', match.func)
+    request = RequestFactory().get(path)
+    request.user = AnonymousUser()
+    return view(request, *match.args, **match.kwargs)
+
+
+def page_file(root, path):
+    return os.path.join(root, path.strip('/'), 'index.html')
+
+
+def write_page(root, path, content):
+    filename = page_file(root, path)
+    directory = os.path.dirname(filename)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # o nginx nunca ve um arquivo pela metade
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(content)
+    os.rename(temp, filename)
+
+
+def remove_page(root, path):
+    filename = page_file(root, path)
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+def load_state(root):
+    try:
+        with open(os.path.join(root, STATE_FILE)) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        return None
+    return parse_datetime(state['built_at']), set(state['pages'])
+
+
+def save_state(root, built_at, pages):
+    with open(os.path.join(root, STATE_FILE), 'w') as f:
+        json.dump({'built_at': built_at.isoformat(), 'pages': sorted(pages)}, f)
+
+
+def prerender(root, full=False):
+    """
+    Gera as paginas publicas em root. Sem full, apenas as paginas afetadas
+    pelo que mudou desde a ultima execucao sao renderizadas de novo.
+    Retorna as paginas geradas, as removidas e as que falharam.
+    """
+    started = timezone.now()
+    state = None if full else load_state(root)
+    pages = site_pages()
+
+    if state is None:
+        dirty, removed = set(pages), set()
+    else:
+        built_at, previous = state
+        removed = previous - pages
+        dirty = changed_pages(built_at - MARGIN) | (pages - previous)
+        if removed:
+            # a palestra apagada ainda aparece nas listagens
+            dirty |= list_pages()
+        dirty &= pages
+
+    rendered, failed = [], []
+    for path in sorted(dirty):
+        response = render_page(path)
+        if response.status_code == 200:
+            write_page(root, path, response.content)
+            rendered.append(path)
+        else:
+            failed.append(path)
+    for path in sorted(removed):
+        remove_page(root, path)
+
+    # o que mudar durante a geracao entra na proxima execucao
+    save_state(root, started, pages - set(failed))
+    return rendered, sorted(removed), failed
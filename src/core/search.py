@@ -0,0 +1,148 @@
+# coding: utf-8
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from .cache import bump_key, get_key_version, after_commit
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+STOPWORDS = frozenset(u"""
+    a ao aos as com da das de do dos e em na nas no nos o os ou para pela
+    pelas pelo pelos por que se sem sobre um uma umas uns
+""".split())
+
+
+def fold(text):
+    """Minusculas e sem acentos: 'Programação' -> 'programacao'"""
+    text = unicode(text).lower()
+    try:
+        text.encode('ascii')
+        return text
+    except UnicodeEncodeError:
+        text = unicodedata.normalize('NFKD', text)
+        return u''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(fold(text))
+            if word not in STOPWORDS]
+
+
+class SearchIndex(object):
+    """
+    Indice invertido em memoria de palestras e palestrantes. E montado na
+    primeira busca em cada processo e atualizado pelos sinais dos models.
+    Uma versao no cache avisa os demais processos, que montam o indice de
+    novo; depois do commit ela e trocada outra vez e todos, este inclusive,
+    remontam o indice com os dados gravados. Os demais processos so veem a
+    troca com um cache compartilhado (CACHES nos settings).
+
+    Os documentos sao pares (tipo, pk); titulo e nome pesam mais que a
+    descricao. A busca exige todas as palavras e ordena por tf-idf.
+    """
+    version_key = 'version:search'
+    # campos indexados e seus pesos, por tipo
+    fields = {
+        'talk': (('title', 3), ('description', 1)),
+        'speaker': (('name', 3), ('description', 1)),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.postings = {}
+        self.documents = {}
+
+    def querysets(self):
+        from .models import Talk, Speaker
+        return {'talk': Talk.objects.all(), 'speaker': Speaker.objects.all()}
+
+    def load(self, version):
+        postings, documents = {}, {}
+        for kind, qs in self.querysets().items():
+            names = [name for name, weight in self.fields[kind]]
+            for row in qs.values_list('pk', *names).iterator():
+                self._add(postings, documents, kind, row[0],
+                          dict(zip(names, row[1:])))
+        self.postings, self.documents, self.version = postings, documents, version
+
+    def ensure_loaded(self):
+        version = get_key_version(self.version_key)
+        if version is None or version != self.version:
+            self.load(version)
+
+    def _add(self, postings, documents, kind, pk, values):
+        doc = (kind, pk)
+        weights = {}
+        for name, weight in self.fields[kind]:
+            for word in tokenize(values[name] or u''):
+                weights[word] = weights.get(word, 0) + weight
+        for word, weight in weights.items():
+            postings.setdefault(word, {})[doc] = weight
+        documents[doc] = list(weights)
+
+    def _remove(self, kind, pk):
+        doc = (kind, pk)
+        for word in self.documents.pop(doc, ()):
+            docs = self.postings.get(word)
+            if docs is not None:
+                docs.pop(doc, None)
+                if not docs:
+                    del self.postings[word]
+
+    def _changed(self, change):
+        """Aplica a alteracao localmente e avisa os outros processos"""
+        with self.lock:
+            up_to_date = self.version is not None
+            if up_to_date:
+                change()
+            version = bump_key(self.version_key)
+            # se outro processo mudou algo antes, o indice local esta velho
+            if up_to_date and version is not None and version == self.version + 1:
+                self.version = version
+            else:
+                self.version = None
+        after_commit(bump_key, self.version_key)
+
+    def update(self, kind, instance):
+        values = dict((name, getattr(instance, name))
+                      for name, weight in self.fields[kind])
+
+        def change():
+            self._remove(kind, instance.pk)
+            self._add(self.postings, self.documents, kind, instance.pk, values)
+        self._changed(change)
+
+    def remove(self, kind, pk):
+        self._changed(lambda: self._remove(kind, pk))
+
+    def search(self, query, limit=20):
+        """Lista de (tipo, pk, pontuacao), da mais relevante para a menos"""
+        words = set(tokenize(query))
+        if not words:
+            return []
+        with self.lock:
+            self.ensure_loaded()
+            postings = sorted((self.postings.get(word, {}) for word in words), key=len)
+            if not postings[0]:
+                return []
+            total = float(len(self.documents))
+            idfs = [math.log(1 + total / len(docs)) for docs in postings]
+            if len(postings) == 1:
+                # com uma palavra a ordem e a do peso; o idf so escala a nota
+                scores, factor = postings[0], idfs[0]
+            else:
+                candidates = set(postings[0])
+                for docs in postings[1:]:
+                    candidates.intersection_update(docs)
+                scores = dict((doc, sum(docs[doc] * idf for docs, idf in zip(postings, idfs)))
+                              for doc in candidates)
+                factor = 1
+            top = heapq.nlargest(limit, scores, key=scores.get)
+            ranked = sorted((-scores[doc] * factor, doc) for doc in top)
+        return [(kind, pk, -score) for score, (kind, pk) in ranked]
+
+
+index = SearchIndex()
@@ -0,0 +1,81 @@
+# coding: utf-8
+
+import json
+import os
+from functools import partial
+from django.conf import settings
+from django.contrib.staticfiles.storage import CachedFilesMixin, CachedStaticFilesStorage
+from django.core.files.base import ContentFile
+from .compression import gzip_compress, brotli_compress
+
+# tipos que valem a pena comprimir; imagens ja sao comprimidas
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt', '.json', '.xml')
+
+# compressao maxima: roda uma vez, no collectstatic
+COMPRESSORS = (
+    ('.gz', partial(gzip_compress, level=9)),
+    ('.br', partial(brotli_compress, quality=11)),
+)
+
+
+class ManifestStaticFilesStorage(CachedStaticFilesStorage):
+    """
+    O collectstatic grava os arquivos com o hash do conteudo no nome, copias
+    .gz e .br ja comprimidas e um manifesto com o nome de cada arquivo. O
+    manifesto e lido uma vez por processo; em producao url() nao abre
+    arquivos nem consulta o cache.
+    """
+    manifest_name = 'staticfiles.json'
+
+    @property
+    def hashed_files(self):
+        if not hasattr(self, '_hashed_files'):
+            self._hashed_files = self.load_manifest()
+        return self._hashed_files
+
+    def load_manifest(self):
+        try:
+            with self.open(self.manifest_name) as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+
+    def save_manifest(self, hashed_files):
+        if self.exists(self.manifest_name):
+            self.delete(self.manifest_name)
+        self._save(self.manifest_name, ContentFile(json.dumps(hashed_files, indent=1)))
+        self._hashed_files = hashed_files
+
+    def url(self, name, force=False):
+        if force:
+            # usado pelo post_process ao reescrever os url() dos css
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        if not settings.DEBUG:
+            name = self.hashed_files.get(name, name)
+        return super(CachedFilesMixin, self).url(name)
+
+    def compress(self, name):
+        """Grava as copias comprimidas, servidas direto pelo nginx"""
+        if os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+            return
+        with self.open(name) as f:
+            content = f.read()
+        for suffix, compressor in COMPRESSORS:
+            compressed = compressor(content)
+            if len(compressed) >= len(content):
+                continue
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        hashed_files = {}
+        for name, hashed_name, processed in super(
+                ManifestStaticFilesStorage, self).post_process(paths, dry_run, **options):
+            hashed_files[name.replace('\\', '/')] = hashed_name
+            if processed or not self.exists(hashed_name + '.gz'):
+                self.compress(hashed_name)
+            yield name, hashed_name, processed
+        self.save_manifest(hashed_files)
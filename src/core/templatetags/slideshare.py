@@ -1,5 +1,6 @@
 from django import template
-from django.template import Context, Template, Node
+from django.template import Node
+from src.core.embeds import EmbedRenderer
 
 
 TEMPLATE = """
@@ -19,6 +20,8 @@ TEMPLATE = """
 </object>
 """
 
+renderer = EmbedRenderer(TEMPLATE)
+
 
 def do_slideshare(parser, token):
     try:
@@ -45,10 +48,8 @@ class SlideShareNode(Node):
         except template.VariableDoesNotExist:
             actual_doc = self.doc
 
-        t = Template(TEMPLATE)
-        c = Context({'id': actual_id, 'doc': actual_doc},
-            autoescape=context.autoescape)
-        return t.render(c)
+        return renderer.render(
+            autoescape=context.autoescape, id=actual_id, doc=actual_doc)
 
 
 register = template.Library()
@@ -1,5 +1,6 @@
 from django import template
-from django.template import Context, Template, Node
+from django.template import Node
+from src.core.embeds import EmbedRenderer
 
 
 TEMPLATE = """
@@ -18,6 +19,8 @@ TEMPLATE = """
 </object>
 """
 
+renderer = EmbedRenderer(TEMPLATE)
+
 
 def do_youtube(parser, token):
     try:
@@ -38,9 +41,7 @@ class YoutubeNode(Node):
             actual_id = self.id.resolve(context)
         except template.VariableDoesNotExist:
             actual_id = self.id
-        t = Template(TEMPLATE)
-        c = Context({'id': actual_id}, autoescape=context.autoescape)
-        return t.render(c)
+        return renderer.render(autoescape=context.autoescape, id=actual_id)
 
 register = template.Library()
 register.tag('youtube', do_youtube)
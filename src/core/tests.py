@@ -1,12 +1,55 @@
 # coding: utf-8
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.core.urlresolvers import reverse as r
-from .models import Speaker, Contact, Talk, PeriodManager, Media
+from .models import Speaker, Contact, Talk, Course, PeriodManager, Media
+from django.db import IntegrityError
+from .embeds import EmbedRenderer
+from django.template import Template, Context
+from django.core.management import call_command
+from StringIO import StringIO
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.utils import translation
+from hashlib import md5
+import os
+import shutil
+import tempfile
+import importlib
+import sys
+import threading
+import time
+import types
+from datetime import timedelta
+from django.utils import timezone
+from mock import patch
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from .thumbnails import generate_variants, variant_name
+from .storage import ManifestStaticFilesStorage
+from .compression import negotiate
+from .search import index as search_index, tokenize
+from .cache import bump_key, forget_pending, run_pending
+from .db.pool import ConnectionPool, PoolExhausted
+from .db.sqlite3.base import DatabaseWrapper as SQLiteWrapper
+from .middleware import CompressionMiddleware
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.contrib.auth.models import AnonymousUser
+from django.core.signals import request_finished
+from django.db import close_connection
+from . import views
+import gzip
+import json
+import brotli
 
 
 class HomepageTest(TestCase):
 
+    def setUp(self):
+        cache.clear()
+
     def test_get_homepage(self):
         response = self.client.get('/')
         self.assertEquals(200, response.status_code)
@@ -34,6 +77,7 @@ class SpeakerModelTest(TestCase):
 class SpeakerDetailTest(TestCase):
     """Testa detalhe dos Speakers"""
     def setUp(self):
+        cache.clear()
         Speaker.objects.create(
             name="Abner Campanha",
             slug="abner-campanha",
@@ -90,6 +134,47 @@ class ContactModelTest(TestCase):
         self.assertEqual(1, contact.pk)
 
 
+class SpeakerContactsTest(TestCase):
+    """Teste do agrupamento de contatos por tipo"""
+    def setUp(self):
+        self.speaker = Speaker.objects.create(
+            name="Abner Campanha",
+            slug="abner-campanha",
+            url="http://abnerpc.com")
+        Contact.objects.create(
+            speaker=self.speaker, kind='E', value='abnerpc@gmail.com')
+        Contact.objects.create(
+            speaker=self.speaker, kind='P', value='12-34567890')
+        other = Speaker.objects.create(
+            name="Outro", slug="outro", url="http://outro.com")
+        Contact.objects.create(speaker=other, kind='F', value='12-34567890')
+
+    def test_grouped(self):
+        contacts = self.speaker.contacts
+        self.assertEqual(['abnerpc@gmail.com'], [c.value for c in contacts['E']])
+        self.assertEqual(['12-34567890'], [c.value for c in contacts['P']])
+        self.assertEqual([], contacts['F'])
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            for kind, name in Contact.KINDS:
+                self.speaker.contacts[kind]
+
+    def test_prefetched(self):
+        with self.assertNumQueries(2):
+            speakers = list(Speaker.objects.with_contacts().order_by('pk'))
+            for speaker in speakers:
+                speaker.contacts
+        self.assertEqual(1, len(speakers[1].contacts['F']))
+
+    def test_forget_on_change(self):
+        self.assertEqual([], self.speaker.contacts['F'])
+        contact = self.speaker.contact_set.create(kind='F', value='12-34567890')
+        self.assertEqual([contact], self.speaker.contacts['F'])
+        contact.delete()
+        self.assertEqual([], self.speaker.contacts['F'])
+
+
 class TalkModelTest(TestCase):
     """Teste do model Talk"""
     def setUp(self):
@@ -127,9 +212,57 @@ class PeriodManagerTest(TestCase):
             lambda t: t.title)
 
 
+class ScheduleTest(TestCase):
+    """Teste da carga da grade completa"""
+    def setUp(self):
+        cache.clear()
+        speaker = Speaker.objects.create(
+            name='Abner Campanha',
+            slug='abner-campanha',
+            url='http://abnerpc.com')
+        for title, start in [('Morning Talk', '10:00'),
+                             ('Other Morning Talk', '11:00'),
+                             ('Afternoon Talk', '13:00')]:
+            talk = Talk.objects.create(title=title, start_time=start)
+            talk.speakers.add(speaker)
+            Media.objects.create(
+                talk=talk, type='YT', media_id='QjA5faZF1A8', title='Video')
+
+    def test_split(self):
+        schedule = Talk.objects.schedule()
+        self.assertEqual(
+            ['Morning Talk', 'Other Morning Talk'],
+            [t.title for t in schedule.morning])
+        self.assertEqual(
+            ['Afternoon Talk'],
+            [t.title for t in schedule.afternoon])
+
+    def test_fixed_queries(self):
+        # palestras, palestrantes e medias
+        with self.assertNumQueries(3):
+            schedule = Talk.objects.schedule()
+            for talk in schedule.morning + schedule.afternoon:
+                list(talk.speakers.all())
+                list(talk.media_set.all())
+        self.assertEqual(3, schedule.queries)
+
+    def test_empty_schedule(self):
+        Talk.objects.all().delete()
+        # sem palestras o prefetch nao consulta o banco
+        with self.assertNumQueries(1):
+            schedule = Talk.objects.schedule()
+        self.assertEqual(([], [], 1), schedule)
+
+    def test_view_queries(self):
+        with self.assertNumQueries(4):
+            resp = self.client.get(r('core:talks'))
+        self.assertContains(resp, 'Abner Campanha', 3)
+
+
 class TalksViewTest(TestCase):
     """Teste da view de Talks"""
     def setUp(self):
+        cache.clear()
         self.resp = self.client.get(r('core:talks'))
 
     def test_get(self):
@@ -145,6 +278,80 @@ class TalksViewTest(TestCase):
         self.assertIn('afternoon_talks', self.resp.context)
 
 
+class TalkSnippetCacheTest(TestCase):
+    """Teste do cache dos fragmentos de palestras"""
+    def setUp(self):
+        cache.clear()
+        self.speaker = Speaker.objects.create(
+            name='Abner Campanha', slug='abner-campanha', url='http://abnerpc.com')
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.talk.speakers.add(self.speaker)
+        self.get()
+
+    def get(self):
+        return self.client.get(r('core:talks'))
+
+    def version(self):
+        return Talk.objects.get(pk=self.talk.pk).cache_version
+
+    def test_cached(self):
+        u'Fragmentos sem alteracao vem do cache.'
+        Talk.objects.filter(pk=self.talk.pk).update(title='Sem sinal')
+        self.assertNotContains(self.get(), 'Sem sinal')
+
+    def test_talk_changed(self):
+        self.talk.title = 'Novo titulo'
+        self.talk.save()
+        self.assertContains(self.get(), 'Novo titulo')
+
+    def test_bumped_after_commit(self):
+        u'Um render entre o sinal e o commit nao fica no cache.'
+        forget_pending()
+        self.talk.title = 'Novo titulo'
+        self.talk.save()
+        # outro request ainda ve os dados de antes do commit
+        Talk.objects.filter(pk=self.talk.pk).update(title='Antes do commit')
+        request = RequestFactory().get(r('core:talks'))
+        request.user = AnonymousUser()
+        views.talks(request)
+        Talk.objects.filter(pk=self.talk.pk).update(title='Novo titulo')
+        # fim do request, depois do commit
+        run_pending()
+        self.assertContains(self.get(), 'Novo titulo')
+
+    def test_speaker_changed(self):
+        self.speaker.name = 'Novo nome'
+        self.speaker.save()
+        self.assertContains(self.get(), 'Novo nome')
+
+    def test_speakers_changed(self):
+        other = Speaker.objects.create(
+            name='Outro', slug='outro', url='http://outro.com')
+        other.talk_set.add(self.talk)
+        self.assertContains(self.get(), 'Outro')
+        self.talk.speakers.remove(self.speaker)
+        self.assertNotContains(self.get(), 'Abner Campanha')
+
+    def test_speaker_clear(self):
+        version = self.version()
+        self.speaker.talk_set.clear()
+        self.assertNotEqual(version, self.version())
+
+    def test_media_changed(self):
+        version = self.version()
+        media = Media.objects.create(
+            talk=self.talk, type='YT', media_id='QjA5faZF1A8', title='Video')
+        self.assertNotEqual(version, self.version())
+        version = self.version()
+        media.delete()
+        self.assertNotEqual(version, self.version())
+
+    def test_versions_single_cache_call(self):
+        Talk.objects.create(title='Other', start_time='11:00')
+        schedule = Talk.objects.schedule()
+        self.assertTrue(all(hasattr(t, '_cache_version') for t in schedule.morning))
+
+
 class MediaModelTest(TestCase):
     """Teste do model Media"""
     def setUp(self):
@@ -164,9 +371,47 @@ class MediaModelTest(TestCase):
         self.assertEqual("Talk 1 - Video", unicode(self.media))
 
 
+class TalkMediasTest(TestCase):
+    """Teste do agrupamento de medias por tipo"""
+    def setUp(self):
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        Media.objects.create(
+            talk=self.talk, type='YT', media_id='QjA5faZF1A8', title='Video')
+        Media.objects.create(
+            talk=self.talk, type='SL', media_id='1234', title='Slide')
+        other = Talk.objects.create(title='Other', start_time='11:00')
+        Media.objects.create(
+            talk=other, type='SL', media_id='5678', title='Other Slide')
+
+    def test_grouped(self):
+        medias = self.talk.medias
+        self.assertEqual(['Slide'], [m.title for m in medias['SL']])
+        self.assertEqual(['Video'], [m.title for m in medias['YT']])
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            self.talk.slides
+            self.talk.videos
+
+    def test_prefetched(self):
+        with self.assertNumQueries(2):
+            talks = list(Talk.objects.with_medias().order_by('pk'))
+            for talk in talks:
+                talk.slides
+                talk.videos
+        self.assertEqual([], talks[1].videos)
+
+    def test_forget_on_change(self):
+        talks = list(Talk.objects.with_medias().filter(pk=self.talk.pk))
+        self.assertEqual(1, len(talks[0].videos))
+        talks[0].media_set.create(type='YT', media_id='abc', title='Other Video')
+        self.assertEqual(2, len(talks[0].videos))
+
+
 class TalkDetailTest(TestCase):
     """Teste da view de detalhe de um talk"""
     def setUp(self):
+        cache.clear()
         talk = Talk.objects.create(
             title='Talk',
             start_time='10:00'
@@ -187,3 +432,929 @@ class TalkDetailTest(TestCase):
     def test_talk_in_context(self):
         talk = self.resp.context['talk']
         self.assertIsInstance(talk, Talk)
+
+
+class EmbedRendererTest(TestCase):
+    """Teste do cache de html dos embeds"""
+    def setUp(self):
+        self.renderer = EmbedRenderer('<p>{{ id }}</p>', maxsize=2)
+
+    def test_render(self):
+        self.assertEqual('<p>abc</p>', self.renderer.render(id='abc'))
+
+    def test_hits_and_misses(self):
+        self.renderer.render(id='abc')
+        self.renderer.render(id='abc')
+        self.renderer.render(id='abc', autoescape=False)
+        self.assertEqual(1, self.renderer.hits)
+        self.assertEqual(2, self.renderer.misses)
+
+    def test_maxsize(self):
+        for id_ in ['a', 'b', 'c']:
+            self.renderer.render(id=id_)
+        self.renderer.render(id='a')
+        self.assertEqual(4, self.renderer.misses)
+
+    def test_template_tag(self):
+        t = Template('{% load youtube %}{% youtube video %}')
+        html = t.render(Context({'video': 'QjA5faZF1A8'}))
+        self.assertIn('http://www.youtube.com/v/QjA5faZF1A8', html)
+
+
+class ExplainQueriesCommandTest(TransactionTestCase):
+    """Teste do comando que verifica os planos das queries"""
+    def test_no_full_scan(self):
+        out = StringIO()
+        call_command('explain_queries', talks=20, subscriptions=20, stdout=out)
+        self.assertNotIn('FAIL', out.getvalue())
+        self.assertFalse(Talk.objects.exists())
+
+
+class AnonymousCacheTest(TestCase):
+    """Teste do cache das paginas publicas"""
+    def setUp(self):
+        cache.clear()
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+
+    def path(self):
+        return r('core:talk_detail', args=[self.talk.pk])
+
+    def get(self):
+        return self.client.get(self.path())
+
+    def key(self):
+        return 'response:%s:%s' % (
+            translation.get_language(), md5(self.path()).hexdigest())
+
+    def test_cached(self):
+        self.get()
+        with self.assertNumQueries(0):
+            resp = self.get()
+        self.assertContains(resp, 'Talk')
+        self.assertEqual('text/html; charset=utf-8', resp['Content-Type'])
+
+    def test_invalidated_by_signals(self):
+        self.get()
+        self.talk.title = 'Novo titulo'
+        self.talk.save()
+        self.assertContains(self.get(), 'Novo titulo')
+
+    def test_stale_while_rebuilding(self):
+        with self.settings(PUBLIC_CACHE_TIMEOUT=-1):
+            self.get()
+            Talk.objects.filter(pk=self.talk.pk).update(title='Sem sinal')
+            cache.add(self.key() + ':lock', True)
+            with self.assertNumQueries(0):
+                self.assertNotContains(self.get(), 'Sem sinal')
+
+    def test_stale_rebuilt(self):
+        with self.settings(PUBLIC_CACHE_TIMEOUT=-1):
+            self.get()
+        Talk.objects.filter(pk=self.talk.pk).update(title='Sem sinal')
+        self.assertContains(self.get(), 'Sem sinal')
+
+    def test_cold_miss_waits(self):
+        self.get()
+        entry = cache.get(self.key())
+        cache.delete(self.key())
+        cache.add(self.key() + ':lock', True)
+        # a pagina e gravada por quem tem o lock durante a espera
+        stored = lambda interval: cache.set(self.key(), entry)
+        with patch('src.core.cache.time.sleep', side_effect=stored):
+            with self.assertNumQueries(0):
+                self.assertContains(self.get(), 'Talk')
+
+    def test_cold_miss_busy(self):
+        cache.add(self.key() + ':lock', True)
+        with self.settings(PUBLIC_CACHE_WAIT=0):
+            with self.assertNumQueries(0):
+                resp = self.get()
+        self.assertEqual(503, resp.status_code)
+        self.assertEqual('1', resp['Retry-After'])
+
+    def test_cold_miss_lock_released(self):
+        cache.add(self.key() + ':lock', True)
+        released = lambda interval: cache.delete(self.key() + ':lock')
+        with patch('src.core.cache.time.sleep', side_effect=released):
+            self.assertContains(self.get(), 'Talk')
+
+    def test_authenticated_not_cached(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        self.get()
+        Talk.objects.filter(pk=self.talk.pk).update(title='Sem sinal')
+        self.client.login(username='admin', password='admin')
+        self.assertContains(self.get(), 'Sem sinal')
+
+
+class ConditionalGetTest(TestCase):
+    """Teste dos validadores das paginas publicas"""
+    def setUp(self):
+        cache.clear()
+        self.speaker = Speaker.objects.create(
+            name='Henrique Bastos', slug='henrique-bastos')
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.talk.speakers.add(self.speaker)
+
+    def paths(self):
+        return [
+            r('core:talks'),
+            r('core:talk_detail', args=[self.talk.pk]),
+            r('core:speaker_detail', kwargs={'slug': self.speaker.slug}),
+            r('core:talks_by_speaker', kwargs={'slug': self.speaker.slug}),
+        ]
+
+    def test_not_modified(self):
+        for path in self.paths():
+            etag = self.client.get(path)['ETag']
+            # respondido pela entrada do cache
+            with self.assertNumQueries(0):
+                resp = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, resp.status_code)
+            self.assertEqual('', resp.content)
+
+    def test_talk_changed(self):
+        path = r('core:talk_detail', args=[self.talk.pk])
+        etag = self.client.get(path)['ETag']
+        self.talk.title = 'Novo titulo'
+        self.talk.save()
+        resp = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(resp, 'Novo titulo')
+        self.assertNotEqual(etag, resp['ETag'])
+
+    def test_stale_page_keeps_its_etag(self):
+        path = r('core:talk_detail', args=[self.talk.pk])
+        etag = self.client.get(path)['ETag']
+        self.talk.title = 'Novo titulo'
+        self.talk.save()
+        # outro request esta regenerando a pagina: sai a velha, com o ETag dela
+        lock_key = 'response:%s:%s:lock' % (translation.get_language(), md5(path).hexdigest())
+        cache.add(lock_key, True)
+        resp = self.client.get(path)
+        self.assertNotContains(resp, 'Novo titulo')
+        self.assertEqual(etag, resp['ETag'])
+        cache.delete(lock_key)
+        resp = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(resp, 'Novo titulo')
+        self.assertNotEqual(etag, resp['ETag'])
+
+    def test_etag_has_deploy_version(self):
+        path = r('core:talk_detail', args=[self.talk.pk])
+        etag = self.client.get(path)['ETag']
+        cache.clear()
+        with patch.object(views, '_deploy_version', 'outro-deploy'):
+            self.assertNotEqual(etag, self.client.get(path)['ETag'])
+
+    def test_media_changes_talk(self):
+        path = r('core:talks')
+        etag = self.client.get(path)['ETag']
+        Media.objects.create(talk=self.talk, type='YT', title='Video',
+                             media_id='QjA5faZF1A8')
+        resp = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, resp.status_code)
+
+    def test_speaker_changes_talks(self):
+        path = r('core:talks_by_speaker', kwargs={'slug': self.speaker.slug})
+        etag = self.client.get(path)['ETag']
+        self.speaker.name = 'Outro nome'
+        self.speaker.save()
+        resp = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(resp, 'Outro nome')
+
+
+class PrerenderSiteTest(TestCase):
+    """Teste do comando prerender_site"""
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.speaker = Speaker.objects.create(
+            name='Henrique Bastos', slug='henrique-bastos')
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.talk.speakers.add(self.speaker)
+        # fora da margem da execucao anterior
+        self.backdate(Speaker.objects.all())
+        self.backdate(Talk.objects.all())
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def backdate(self, qs, seconds=3600):
+        qs.update(updated_at=timezone.now() - timedelta(seconds=seconds))
+
+    def prerender(self, *args):
+        out = StringIO()
+        call_command('prerender_site', *args, root=self.root, stdout=out)
+        return [line.split(' ', 1)[1] for line in out.getvalue().splitlines()
+                if line.startswith(('Gerada', 'Removida'))]
+
+    def read(self, path):
+        with open(os.path.join(self.root, path.strip('/'), 'index.html')) as f:
+            return f.read()
+
+    def test_full(self):
+        pages = self.prerender()
+        self.assertItemsEqual([
+            '/', '/palestras/', '/palestras/%d/' % self.talk.pk,
+            '/palestrantes/henrique-bastos/',
+            '/palestras/speaker/henrique-bastos/'], pages)
+        self.assertIn('Henrique Bastos', self.read('/palestras/'))
+
+    def test_unchanged(self):
+        self.prerender()
+        self.assertEqual([], self.prerender())
+
+    def test_media_changed(self):
+        self.prerender()
+        Media.objects.create(talk=self.talk, type='YT', title='Video',
+                             media_id='QjA5faZF1A8')
+        pages = self.prerender()
+        self.assertIn('/palestras/%d/' % self.talk.pk, pages)
+        self.assertNotIn('/palestrantes/henrique-bastos/', pages)
+        self.assertIn('QjA5faZF1A8', self.read('/palestras/%d/' % self.talk.pk))
+
+    def test_speaker_changed(self):
+        self.prerender()
+        self.speaker.name = 'Outro nome'
+        self.speaker.save()
+        self.assertItemsEqual([
+            '/palestras/', '/palestras/%d/' % self.talk.pk,
+            '/palestrantes/henrique-bastos/',
+            '/palestras/speaker/henrique-bastos/'], self.prerender())
+        self.assertIn('Outro nome', self.read('/palestras/'))
+
+    def test_speaker_removed(self):
+        other = Speaker.objects.create(name='Abner Campanha', slug='abner-campanha')
+        self.talk.speakers.add(other)
+        self.backdate(Speaker.objects.all())
+        self.backdate(Talk.objects.all())
+        self.prerender()
+        self.talk.speakers.remove(other)
+        self.assertIn('/palestras/speaker/abner-campanha/', self.prerender())
+        self.assertNotIn('Talk', self.read('/palestras/speaker/abner-campanha/'))
+
+    def test_speaker_cleared(self):
+        self.prerender()
+        self.speaker.talk_set.clear()
+        self.assertIn('/palestras/speaker/henrique-bastos/', self.prerender())
+        self.assertNotIn('Talk', self.read('/palestras/speaker/henrique-bastos/'))
+
+    def test_committed_after_previous_run(self):
+        self.prerender()
+        # gravado antes do inicio da execucao anterior, visivel so depois dela
+        Talk.objects.filter(pk=self.talk.pk).update(title='Atrasada')
+        self.backdate(Talk.objects.all(), seconds=10)
+        self.assertIn('/palestras/%d/' % self.talk.pk, self.prerender())
+        self.assertIn('Atrasada', self.read('/palestras/%d/' % self.talk.pk))
+
+    def test_talk_deleted(self):
+        self.prerender()
+        path = '/palestras/%d/' % self.talk.pk
+        self.talk.delete()
+        pages = self.prerender()
+        self.assertIn(path, pages)
+        self.assertIn('/palestras/speaker/henrique-bastos/', pages)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, path.strip('/'), 'index.html')))
+        self.assertNotIn('Talk', self.read('/palestras/'))
+
+    def test_serves_current_page(self):
+        self.client.get(r('core:talks'))
+        Talk.objects.filter(pk=self.talk.pk).update(title='Sem sinal')
+        self.prerender('--all')
+        self.assertIn('Sem sinal', self.read('/palestras/'))
+
+
+class SpeakerAvatarTest(TestCase):
+    """Teste das miniaturas do avatar"""
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        field = Speaker._meta.get_field('avatar')
+        storage = FileSystemStorage(location=self.root, base_url='/media/')
+        self.patcher = patch.object(field, 'storage', storage)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.root)
+
+    def image(self, size=(1200, 900)):
+        f = StringIO()
+        Image.new('RGB', size, 'red').save(f, 'JPEG')
+        return ContentFile(f.getvalue())
+
+    def create(self):
+        speaker = Speaker(name='Abner Campanha', slug='abner-campanha',
+                          url='http://abnerpc.com')
+        speaker.avatar.save('abner.jpg', self.image(), save=False)
+        speaker.save()
+        return speaker
+
+    def width(self, name):
+        return Image.open(os.path.join(self.root, name)).size[0]
+
+    def test_generated_on_upload(self):
+        self.create()
+        for width in (80, 160, 320):
+            name = variant_name('palestrantes/abner.jpg', width)
+            self.assertEqual(width, self.width(name))
+
+    def test_generated_on_first_request(self):
+        speaker = self.create()
+        os.remove(os.path.join(self.root, 'palestrantes/abner-160w.jpg'))
+        resp = self.client.get(r('core:speaker_detail',
+                                 kwargs={'slug': speaker.slug}))
+        self.assertContains(resp, 'src="/media/palestrantes/abner-160w.jpg"')
+        self.assertContains(resp, '/media/palestrantes/abner-320w.jpg 320w')
+        self.assertEqual(160, self.width('palestrantes/abner-160w.jpg'))
+
+    def test_small_original(self):
+        u'O srcset traz a largura real das variantes de um original pequeno.'
+        speaker = Speaker(name='Abner Campanha', slug='abner-campanha',
+                          url='http://abnerpc.com')
+        speaker.avatar.save('abner.jpg', self.image(size=(120, 90)), save=False)
+        speaker.save()
+        self.assertEqual(
+            '/media/palestrantes/abner-80w.jpg 80w, '
+            '/media/palestrantes/abner-160w.jpg 120w',
+            speaker.avatar_srcset)
+        self.assertEqual('/media/palestrantes/abner.jpg', speaker.avatar_thumbnail)
+
+    def test_concurrent_generation(self):
+        speaker = self.create()
+        for width in (80, 160, 320):
+            os.remove(os.path.join(self.root, variant_name(speaker.avatar.name, width)))
+        generated = []
+        threads = [threading.Thread(
+            target=lambda: generated.extend(generate_variants(speaker.avatar)))
+            for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertItemsEqual([80, 160, 320], generated)
+
+    def test_not_an_image(self):
+        speaker = Speaker(name='Abner Campanha', slug='abner-campanha',
+                          url='http://abnerpc.com')
+        speaker.avatar.save('abner.txt', ContentFile('texto'), save=False)
+        speaker.save()
+        self.assertEqual('', speaker.avatar_srcset)
+        self.assertEqual('/media/palestrantes/abner.txt', speaker.avatar_thumbnail)
+
+
+class ManifestStaticFilesStorageTest(TestCase):
+    """Teste do collectstatic com hash, manifesto e copias comprimidas"""
+    @classmethod
+    def setUpClass(cls):
+        # o collectstatic copia tambem os arquivos do admin; roda uma vez
+        cls.root = tempfile.mkdtemp()
+        cls.storage = ManifestStaticFilesStorage(location=cls.root)
+        with patch('django.contrib.staticfiles.storage.staticfiles_storage',
+                   cls.storage):
+            call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(cls.root, 'staticfiles.json')) as f:
+            cls.manifest = json.load(f)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+
+    def test_manifest(self):
+        css = self.manifest['css/styles.css']
+        self.assertRegexpMatches(css, r'^css/styles\.[0-9a-f]{12}\.css$')
+        self.assertEqual(self.read('css/styles.css'), self.read(css))
+
+    def test_precompressed(self):
+        css = self.manifest['css/styles.css']
+        content = self.read(css)
+        gz = gzip.GzipFile(fileobj=StringIO(self.read(css + '.gz')))
+        self.assertEqual(content, gz.read())
+        self.assertEqual(content, brotli.decompress(self.read(css + '.br')))
+        # imagens ja sao comprimidas
+        self.assertFalse(os.path.exists(
+            os.path.join(self.root, self.manifest['img/logo.jpg'] + '.gz')))
+
+    def test_url_from_memory(self):
+        storage = ManifestStaticFilesStorage(location=self.root)
+        with self.settings(DEBUG=False):
+            storage.url('css/styles.css')
+            with patch.object(storage, 'open') as open_:
+                url = storage.url('img/logo.jpg')
+        self.assertFalse(open_.called)
+        self.assertEqual('/static/' + self.manifest['img/logo.jpg'], url)
+
+    def test_debug_url(self):
+        with self.settings(DEBUG=True):
+            self.assertEqual('/static/css/styles.css',
+                             self.storage.url('css/styles.css'))
+
+    def test_unknown_file(self):
+        with self.settings(DEBUG=False):
+            self.assertEqual('/static/js/nada.js', self.storage.url('js/nada.js'))
+
+
+class CompressionMiddlewareTest(TestCase):
+    """Teste da compressao das respostas"""
+    def setUp(self):
+        cache.clear()
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+
+    def get(self, encoding, path=None):
+        return self.client.get(path or r('core:talks'),
+                               HTTP_ACCEPT_ENCODING=encoding)
+
+    def test_negotiate(self):
+        self.assertEqual('br', negotiate('gzip, deflate, br'))
+        self.assertEqual('gzip', negotiate('gzip;q=1.0, br;q=0'))
+        self.assertEqual('gzip', negotiate('GZIP'))
+        self.assertEqual(None, negotiate('identity'))
+
+    def test_brotli(self):
+        resp = self.get('gzip, br')
+        self.assertEqual('br', resp['Content-Encoding'])
+        self.assertIn('Talk', brotli.decompress(resp.content))
+        self.assertIn('Accept-Encoding', resp['Vary'])
+
+    def test_gzip(self):
+        resp = self.get('gzip')
+        self.assertEqual('gzip', resp['Content-Encoding'])
+        self.assertEqual(str(len(resp.content)), resp['Content-Length'])
+        content = gzip.GzipFile(fileobj=StringIO(resp.content)).read()
+        self.assertIn('Talk', content)
+
+    def test_not_accepted(self):
+        resp = self.get('')
+        self.assertFalse(resp.has_header('Content-Encoding'))
+        self.assertIn('Talk', resp.content)
+
+    def test_skipped(self):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        small = HttpResponse('x' * 100)
+        image = HttpResponse('x' * 1000, content_type='image/jpeg')
+        encoded = HttpResponse('x' * 1000)
+        encoded['Content-Encoding'] = 'gzip'
+        for resp in (small, image, encoded):
+            content = resp.content
+            CompressionMiddleware().process_response(request, resp)
+            self.assertEqual(content, resp.content)
+
+    def test_cached_not_compressed_again(self):
+        self.get('br')
+        with patch('src.core.middleware.compress') as compress:
+            resp = self.get('br')
+        self.assertFalse(compress.called)
+        self.assertIn('Talk', brotli.decompress(resp.content))
+
+    def test_not_modified(self):
+        etag = self.get('gzip')['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        resp = self.client.get(r('core:talks'), HTTP_IF_NONE_MATCH=etag,
+                               HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(304, resp.status_code)
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_compression', talks=4, repeat=2, stdout=out)
+        self.assertIn('core:talk_detail', out.getvalue())
+        self.assertEqual(1, Talk.objects.count())
+
+
+class TalksBySpeakerTest(TestCase):
+    """Teste das palestras por palestrante"""
+    def setUp(self):
+        cache.clear()
+        self.henrique = Speaker.objects.create(
+            name='Henrique Bastos', slug='henrique-bastos')
+        self.abner = Speaker.objects.create(
+            name='Abner Campanha', slug='abner-campanha')
+        for i in range(3):
+            talk = Talk.objects.create(title='Talk %d' % i, start_time='1%d:00' % i)
+            talk.speakers.add(self.henrique, self.abner)
+
+    def get(self, slug):
+        return self.client.get(r('core:talks_by_speaker', kwargs={'slug': slug}))
+
+    def test_queries(self):
+        # etag, join pelo slug e prefetch de palestrantes e medias
+        with self.assertNumQueries(4):
+            resp = self.get('henrique-bastos')
+        self.assertContains(resp, 'Abner Campanha', 3)
+
+    def test_not_found(self):
+        self.assertEqual(404, self.get('ninguem').status_code)
+
+    def test_speaker_without_talks(self):
+        Speaker.objects.create(name='Sem palestras', slug='sem-palestras')
+        self.assertContains(self.get('sem-palestras'), u'Não existem palestras')
+
+    def test_speaker_deleted(self):
+        self.get('henrique-bastos')
+        self.henrique.delete()
+        self.assertEqual(404, self.get('henrique-bastos').status_code)
+
+    def test_unique_slug(self):
+        self.assertRaises(IntegrityError, Speaker.objects.create,
+                          name='Outro Henrique', slug='henrique-bastos')
+
+
+class CourseKindTest(TestCase):
+    """Teste do tipo de palestra e dos cursos na grade"""
+    def setUp(self):
+        cache.clear()
+        speaker = Speaker.objects.create(
+            name='Abner Campanha', slug='abner-campanha')
+        self.talk = Talk.objects.create(title='Talk', start_time='10:00')
+        self.course = Course.objects.create(
+            title='Tutorial', start_time='14:00', slots=20, notes='')
+        self.talk.speakers.add(speaker)
+        self.course.speakers.add(speaker)
+
+    def test_kind(self):
+        self.assertEqual(Talk.TALK, self.talk.kind)
+        self.assertEqual(Talk.COURSE, Talk.objects.get(pk=self.course.pk).kind)
+
+    def test_talk_is_not_course(self):
+        talk = Talk.objects.get(pk=self.talk.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(talk.is_course)
+            self.assertEqual(None, talk.as_course)
+
+    def test_schedule_with_courses(self):
+        # o curso vem no join das palestras
+        with self.assertNumQueries(3):
+            schedule = Talk.objects.schedule()
+            self.assertEqual(
+                [None, 20],
+                [t.as_course and t.as_course.slots
+                 for t in schedule.morning + schedule.afternoon])
+        self.assertEqual(3, schedule.queries)
+
+    def test_view(self):
+        with self.assertNumQueries(4):
+            resp = self.client.get(r('core:talks'))
+        self.assertContains(resp, 'Tutorial')
+
+
+class SearchTest(TestCase):
+    """Teste da busca por palestras e palestrantes"""
+    def setUp(self):
+        cache.clear()
+        self.talk = Talk.objects.create(
+            title=u'Programação funcional', start_time='10:00',
+            description=u'Introdução a Python')
+        self.other = Talk.objects.create(
+            title=u'Django', start_time='11:00',
+            description=u'Programação web com Python e Django')
+        self.speaker = Speaker.objects.create(
+            name=u'Henrique Bastos', slug='henrique-bastos',
+            description=u'Programação e empreendedorismo')
+
+    def search(self, query):
+        return [(kind, pk) for kind, pk, score in search_index.search(query)]
+
+    def test_tokenize(self):
+        self.assertEqual([u'programacao', u'funcional', u'python'],
+                         tokenize(u'Programação Funcional de PYTHON'))
+
+    def test_accents(self):
+        self.assertEqual(self.search(u'programação'), self.search(u'PROGRAMACAO'))
+
+    def test_ranked(self):
+        self.assertEqual(
+            [('talk', self.talk.pk), ('speaker', self.speaker.pk),
+             ('talk', self.other.pk)],
+            self.search(u'programacao'))
+
+    def test_all_words(self):
+        self.assertEqual([('talk', self.other.pk)], self.search(u'web python'))
+        self.assertEqual([], self.search(u'web ruby'))
+        self.assertEqual([], self.search(u'de a'))
+
+    def test_incremental(self):
+        search_index.ensure_loaded()
+        with patch.object(search_index, 'load') as load:
+            talk = Talk.objects.create(title=u'Testes', start_time='12:00')
+            self.assertEqual([('talk', talk.pk)], self.search(u'testes'))
+            talk.title = u'Automação'
+            talk.save()
+            self.assertEqual([], self.search(u'testes'))
+            self.assertEqual([('talk', talk.pk)], self.search(u'automacao'))
+            talk.delete()
+            self.assertEqual([], self.search(u'automacao'))
+        self.assertFalse(load.called)
+
+    def test_changed_by_other_process(self):
+        search_index.ensure_loaded()
+        Talk.objects.filter(pk=self.talk.pk).update(title=u'Testes')
+        bump_key(search_index.version_key)
+        self.assertEqual([('talk', self.talk.pk)], self.search(u'testes'))
+
+    def test_rebuilt_after_commit(self):
+        u'Depois do commit o indice e remontado com os dados gravados.'
+        search_index.ensure_loaded()
+        forget_pending()
+        self.talk.title = u'Testes'
+        self.talk.save()
+        # a transacao foi desfeita
+        Talk.objects.filter(pk=self.talk.pk).update(title=u'Outro')
+        run_pending()
+        self.assertEqual([], self.search(u'testes'))
+
+    def test_view(self):
+        resp = self.client.get(r('core:search'), {'q': u'henrique'})
+        self.assertContains(resp, u'Henrique Bastos')
+        self.assertContains(resp, u'Nenhuma palestra encontrada')
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmark_search', talks=20, speakers=5, repeat=1, stdout=out)
+        self.assertIn('django', out.getvalue())
+        self.assertEqual(2, Talk.objects.count())
+
+
+class FakeConnection(object):
+    """Conexao de mentira para testar o pool sem PostgreSQL"""
+    def __init__(self):
+        self.closed = 0
+        self.rollbacks = 0
+        self.queries = 0
+        self.broken = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        if self.broken:
+            raise self.error('server closed the connection')
+
+    def close(self):
+        self.closed = 1
+
+    error = Exception
+
+    # usados pelo backend do Django ao abrir a conexao
+    server_version = 90200
+
+    def set_client_encoding(self, encoding):
+        pass
+
+    def get_parameter_status(self, name):
+        return 'UTC'
+
+    def set_isolation_level(self, level):
+        pass
+
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, params=None):
+        self.connection.queries += 1
+        if self.connection.broken:
+            raise self.connection.error('server closed the connection')
+
+    def close(self):
+        pass
+
+
+def fake_psycopg2():
+    """Modulos psycopg2 de mentira, com conexoes FakeConnection"""
+    extensions = types.ModuleType('psycopg2.extensions')
+    extensions.UNICODE = object()
+    extensions.register_type = extensions.register_adapter = lambda *args: None
+    extensions.QuotedString = object
+    extensions.ISOLATION_LEVEL_AUTOCOMMIT = 0
+    extensions.ISOLATION_LEVEL_READ_COMMITTED = 1
+    psycopg2 = types.ModuleType('psycopg2')
+    psycopg2.extensions = extensions
+    psycopg2.DatabaseError = type('DatabaseError', (Exception,), {})
+    psycopg2.IntegrityError = type('IntegrityError', (psycopg2.DatabaseError,), {})
+    psycopg2.connect = lambda **params: FakeConnection()
+    return {'psycopg2': psycopg2, 'psycopg2.extensions': extensions}
+
+
+class ConnectionPoolTest(TestCase):
+    """Teste do pool de conexoes do backend PostgreSQL"""
+    def setUp(self):
+        self.pool = ConnectionPool(size=2, max_lifetime=60, check_after=10, timeout=0.05)
+        self.opened = []
+
+    def connect(self):
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def test_reused(self):
+        connection = self.pool.get(self.connect)
+        self.pool.put(connection)
+        self.assertIs(connection, self.pool.get(self.connect))
+        self.assertEqual(1, len(self.opened))
+        self.assertEqual(1, connection.rollbacks)
+
+    def test_size_limit(self):
+        first = self.pool.get(self.connect)
+        self.pool.get(self.connect)
+        self.assertRaises(PoolExhausted, self.pool.get, self.connect)
+        self.pool.put(first)
+        self.assertIs(first, self.pool.get(self.connect))
+
+    def test_waits_for_connection(self):
+        first = self.pool.get(self.connect)
+        self.pool.get(self.connect)
+        self.pool.timeout = 1
+        threading.Timer(0.05, self.pool.put, [first]).start()
+        self.assertIs(first, self.pool.get(self.connect))
+
+    def test_max_lifetime(self):
+        connection = self.pool.get(self.connect)
+        self.pool.created[connection] -= 61
+        self.pool.put(connection)
+        self.assertTrue(connection.closed)
+        self.assertIsNot(connection, self.pool.get(self.connect))
+
+    def test_health_check(self):
+        connection = self.pool.get(self.connect)
+        self.pool.put(connection)
+        connection.broken = True
+        # devolvida ha pouco: reaproveitada sem ida ao banco
+        self.assertIs(connection, self.pool.get(self.connect))
+        self.assertEqual(0, connection.queries)
+        self.pool.put(connection)
+        self.pool.idle = [(connection, time.time() - 11)]
+        fresh = self.pool.get(self.connect)
+        self.assertIsNot(connection, fresh)
+        self.assertTrue(connection.closed)
+        self.assertEqual(1, self.pool.in_use)
+
+    def test_closed_connection_discarded(self):
+        connection = self.pool.get(self.connect)
+        connection.close()
+        self.pool.put(connection)
+        self.assertEqual(0, self.pool.in_use)
+        self.assertEqual([], self.pool.idle)
+
+    def test_connect_error_frees_slot(self):
+        def fail():
+            raise Exception('could not connect')
+        self.assertRaises(Exception, self.pool.get, fail)
+        self.assertEqual(0, self.pool.in_use)
+
+
+class PostgresWrapperTest(TestCase):
+    """Teste do backend PostgreSQL com conexoes persistentes, sem o servidor"""
+    def setUp(self):
+        self.modules = patch.dict(sys.modules, fake_psycopg2())
+        self.modules.start()
+        for name in list(sys.modules):
+            if name.startswith(('src.core.db.postgresql.',
+                                'django.db.backends.postgresql_psycopg2')):
+                del sys.modules[name]
+        self.base = importlib.import_module('src.core.db.postgresql.base')
+
+    def tearDown(self):
+        self.base.pools.clear()
+        self.modules.stop()
+
+    def wrapper(self, **options):
+        settings_dict = {'NAME': 'eventex', 'USER': '', 'PASSWORD': '',
+                         'HOST': '', 'PORT': '', 'OPTIONS': {}}
+        settings_dict.update(options)
+        connection = self.base.DatabaseWrapper(settings_dict, 'pg')
+        connection.cursor()
+        return connection
+
+    def request_finished(self, connection):
+        with patch.object(self.base, 'connections', {'pg': connection}):
+            self.base.release_connections()
+
+    def test_signal_not_swapped_unless_configured(self):
+        receivers = [ref() for key, ref in request_finished.receivers]
+        self.assertIn(close_connection, receivers)
+        self.assertNotIn(self.base.release_connections, receivers)
+
+    def test_signal_swapped_when_configured(self):
+        del sys.modules['src.core.db.postgresql.base']
+        databases = {'default': {'ENGINE': 'src.core.db.postgresql'}}
+        try:
+            with self.settings(DATABASES=databases):
+                base = importlib.import_module('src.core.db.postgresql.base')
+            receivers = [ref() for key, ref in request_finished.receivers]
+            self.assertNotIn(close_connection, receivers)
+            self.assertIn(base.release_connections, receivers)
+        finally:
+            request_finished.disconnect(base.release_connections)
+            request_finished.connect(close_connection)
+
+    def test_closed_without_max_age(self):
+        connection = self.wrapper()
+        raw = connection.connection
+        self.request_finished(connection)
+        self.assertEqual(None, connection.connection)
+        self.assertTrue(raw.closed)
+
+    def test_persistent(self):
+        connection = self.wrapper(CONN_MAX_AGE=600)
+        raw = connection.connection
+        self.request_finished(connection)
+        self.assertIs(raw, connection.connection)
+        self.assertEqual(1, raw.rollbacks)
+        connection.cursor()
+        self.assertIs(raw, connection.connection)
+        self.assertFalse(raw.closed)
+
+    def test_persistent_expired(self):
+        connection = self.wrapper(CONN_MAX_AGE=600)
+        raw = connection.connection
+        connection.connected_at -= 601
+        self.request_finished(connection)
+        self.assertEqual(None, connection.connection)
+        self.assertTrue(raw.closed)
+
+    def test_pool_on_request_finished(self):
+        connection = self.wrapper(POOL_SIZE=2)
+        raw = connection.connection
+        self.request_finished(connection)
+        self.assertEqual(None, connection.connection)
+        self.assertEqual([raw], [c for c, released_at in connection.pool.idle])
+        self.assertEqual(0, connection.pool.in_use)
+        connection.cursor()
+        self.assertIs(raw, connection.connection)
+        self.assertEqual(1, connection.pool.in_use)
+
+    def test_broken_persistent_discarded(self):
+        connection = self.wrapper(CONN_MAX_AGE=600)
+        raw = connection.connection
+        self.request_finished(connection)
+        raw.broken = True
+        connection.released_at -= 31
+        connection.cursor()
+        self.assertIsNot(raw, connection.connection)
+        self.assertTrue(raw.closed)
+
+    def test_broken_pooled_discarded(self):
+        connection = self.wrapper(POOL_SIZE=2)
+        raw = connection.connection
+        self.request_finished(connection)
+        raw.broken = True
+        connection.pool.idle = [(raw, time.time() - 31)]
+        connection.cursor()
+        self.assertIsNot(raw, connection.connection)
+        self.assertTrue(raw.closed)
+        self.assertEqual(1, connection.pool.in_use)
+
+    def test_transaction_state_after_rollback(self):
+        connection = self.wrapper(CONN_MAX_AGE=600)
+        raw = connection.connection
+        connection.enter_transaction_management()
+        connection.managed(True)
+        connection.set_dirty()
+        self.request_finished(connection)
+        self.assertFalse(connection.is_dirty())
+        self.assertFalse(connection.is_managed())
+        self.assertEqual([], connection.transaction_state)
+        # o abort desfaz a transacao e o release garante antes de guardar
+        self.assertEqual(2, raw.rollbacks)
+        self.assertIs(raw, connection.connection)
+
+    def test_failed_rollback_closes(self):
+        connection = self.wrapper(CONN_MAX_AGE=600)
+        raw = connection.connection
+        raw.error = self.base.DatabaseError
+        raw.broken = True
+        self.request_finished(connection)
+        self.assertEqual(None, connection.connection)
+        self.assertTrue(raw.closed)
+
+
+class SQLitePragmasTest(TestCase):
+    """Teste do backend SQLite para requests simultaneos"""
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.settings_dict = {'NAME': os.path.join(self.path, 'db.sqlite3'), 'OPTIONS': {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def pragma(self, connection, name):
+        return connection.cursor().execute('PRAGMA %s' % name).fetchone()[0]
+
+    def test_pragmas(self):
+        connection = SQLiteWrapper(self.settings_dict, 'tuned')
+        self.assertEqual('wal', self.pragma(connection, 'journal_mode'))
+        self.assertEqual(1, self.pragma(connection, 'synchronous'))
+        self.assertEqual(5000, self.pragma(connection, 'busy_timeout'))
+        self.assertEqual(-16000, self.pragma(connection, 'cache_size'))
+        connection.close()
+
+    def test_custom_pragmas(self):
+        self.settings_dict['PRAGMAS'] = (('busy_timeout', 100),)
+        connection = SQLiteWrapper(self.settings_dict, 'tuned')
+        self.assertEqual('delete', self.pragma(connection, 'journal_mode'))
+        self.assertEqual(100, self.pragma(connection, 'busy_timeout'))
+        connection.close()
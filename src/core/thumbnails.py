@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import fcntl
+import os
+from PIL import Image
+
+# larguras fixas das variantes, em pixels
+AVATAR_WIDTHS = (80, 160, 320)
+# largura em que o avatar aparece na pagina; 320 atende telas retina
+AVATAR_DISPLAY_WIDTH = 160
+JPEG_OPTIONS = {'quality': 85, 'optimize': True, 'progressive': True}
+
+
+def variant_name(name, width):
+    """palestrantes/foto.jpg -> palestrantes/foto-160w.jpg"""
+    base, ext = os.path.splitext(name)
+    return '%s-%dw%s' % (base, width, ext)
+
+
+def save_variant(image, path, width):
+    variant = image.copy()
+    # thumbnail mantem a proporcao e nunca amplia a imagem
+    variant.thumbnail((width, width * 100), Image.ANTIALIAS)
+
+    options = {}
+    if image.format == 'JPEG':
+        options = JPEG_OPTIONS
+        if variant.mode != 'RGB':
+            variant = variant.convert('RGB')
+    elif image.format == 'PNG':
+        options = {'optimize': True}
+
+    # quem le o arquivo nunca ve a variante pela metade
+    temp = path + '.tmp'
+    variant.save(temp, image.format, **options)
+    os.rename(temp, path)
+
+
+def generate_variants(fieldfile, widths=AVATAR_WIDTHS):
+    """
+    Gera as variantes que faltam. O lock no arquivo original impede que
+    requests ou processos concorrentes gerem a mesma variante duas vezes.
+    """
+    storage = fieldfile.storage
+    with open(fieldfile.path, 'rb') as original:
+        fcntl.flock(original, fcntl.LOCK_EX)
+        try:
+            missing = [width for width in widths
+                       if not storage.exists(variant_name(fieldfile.name, width))]
+            if not missing:
+                return []
+            image = Image.open(original)
+            image.load()
+            for width in missing:
+                save_variant(image, storage.path(variant_name(fieldfile.name, width)), width)
+            return missing
+        finally:
+            fcntl.flock(original, fcntl.LOCK_UN)
+
+
+def avatar_variants(fieldfile, widths=AVATAR_WIDTHS):
+    """
+    Lista de (largura real, url) das variantes, geradas no primeiro acesso.
+    Vazia se nao houver arquivo ou se ele nao for uma imagem.
+    """
+    if not fieldfile:
+        return []
+    storage = fieldfile.storage
+    names = [variant_name(fieldfile.name, width) for width in widths]
+    variants = {}
+    try:
+        if not all(storage.exists(name) for name in names):
+            generate_variants(fieldfile, widths)
+        for name in names:
+            # a variante nunca e ampliada: de um original pequeno ela sai
+            # mais estreita que o nome diz, e a menor de mesma largura basta
+            variants.setdefault(image_width(storage.path(name)), storage.url(name))
+    except IOError:
+        return []
+    return sorted(variants.items())
+
+
+def image_width(path):
+    """Largura lida do cabecalho do arquivo, sem decodificar a imagem"""
+    with open(path, 'rb') as f:
+        return Image.open(f).size[0]
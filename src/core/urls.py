@@ -11,4 +11,5 @@ urlpatterns = patterns('src.core.views',
     url(r'^palestras/$', 'talks', name='talks'),
     url(r'^palestras/(\d+)/$', 'talk_detail', name='talk_detail'),
     url(r'^palestras/speaker/(?P<slug>[\w-]+)/$', 'talks_by_speaker', name='talks_by_speaker'),
+    url(r'^busca/$', 'search', name='search'),
     )
@@ -1,14 +1,85 @@
 # coding: utf-8
 
+import os
+from hashlib import md5
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.db.models import Count, Max
+from django.template.loaders.app_directories import app_template_dirs
+from django.views.decorators.http import condition
 from django.views.generic.simple import direct_to_template
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from src.core.models import Speaker, Talk
+from src.core.models import Speaker, Talk, attach_cache_versions
+from src.core.cache import anonymous_cache
+from src.core.search import index as search_index
 
 
+def deploy_version():
+    """
+    Versao do que muda as paginas sem mudar o banco: DEPLOY_VERSION, se
+    definida, ou o conteudo dos templates do projeto e o manifesto dos
+    arquivos estaticos, calculados uma vez por processo.
+    """
+    global _deploy_version
+    if _deploy_version is None:
+        version = md5(settings.DEPLOY_VERSION)
+        if not settings.DEPLOY_VERSION:
+            dirs = [d for d in list(settings.TEMPLATE_DIRS) + list(app_template_dirs)
+                    if d.startswith(settings.PROJECT_DIR)]
+            for root, dirnames, filenames in sorted(w for d in dirs for w in os.walk(d)):
+                for filename in sorted(filenames):
+                    with open(os.path.join(root, filename), 'rb') as f:
+                        version.update(f.read())
+            version.update(repr(sorted(staticfiles_storage.hashed_files.items())))
+        _deploy_version = version.hexdigest()
+    return _deploy_version
+
+
+_deploy_version = None
+
+
+def make_etag(*values):
+    """ETag a partir dos valores que identificam a versao da pagina e do deploy"""
+    return md5(repr((deploy_version(),) + values)).hexdigest()
+
+
+def talks_etag(queryset):
+    """ETag de uma lista de palestras com uma unica consulta agregada"""
+    stats = queryset.aggregate(Max('updated_at'), Count('pk'))
+    return make_etag(stats['updated_at__max'], stats['pk__count'])
+
+
+def updated_etag(queryset):
+    """ETag de um unico objeto pelo seu updated_at, None se nao existir"""
+    updated_at = queryset.values_list('updated_at', flat=True)[:1]
+    if updated_at:
+        return make_etag(updated_at[0])
+
+
+def speaker_etag(request, slug):
+    return updated_etag(Speaker.objects.filter(slug=slug))
+
+
+def schedule_etag(request):
+    return talks_etag(Talk.objects.all())
+
+
+def talk_etag(request, pk):
+    return updated_etag(Talk.objects.filter(pk=pk))
+
+
+def speaker_talks_etag(request, slug):
+    return talks_etag(Talk.objects.filter(speakers__slug=slug))
+
+
+@anonymous_cache
 def homepage(request):
     return direct_to_template(request, template='index.html')
 
 
+@anonymous_cache
+@condition(etag_func=speaker_etag)
 def speaker_detail(request, slug):
     speaker = get_object_or_404(Speaker, slug=slug)
     return direct_to_template(
@@ -17,20 +88,50 @@ def speaker_detail(request, slug):
         {'speaker': speaker})
 
 
+@anonymous_cache
+@condition(etag_func=schedule_etag)
 def talks(request):
+    schedule = Talk.objects.schedule()
     context = {
-        'morning_talks': Talk.objects.at_morning(),
-        'afternoon_talks': Talk.objects.at_afternoon(),
+        'morning_talks': schedule.morning,
+        'afternoon_talks': schedule.afternoon,
     }
     return direct_to_template(request, 'core/talks.html', context)
 
 
+@anonymous_cache
+@condition(etag_func=talk_etag)
 def talk_detail(request, pk):
     talk = get_object_or_404(Talk, pk=pk)
     return direct_to_template(request, 'core/talk_detail.html', {'talk': talk})
 
 
+@anonymous_cache
+@condition(etag_func=speaker_talks_etag)
 def talks_by_speaker(request, slug):
-    speaker = get_object_or_404(Speaker, slug=slug)
-    talks = Talk.objects.filter(speakers__in=[speaker.pk])
+    talks = list(Talk.objects.by_speaker(slug))
+    if not talks and not Speaker.objects.filter(slug=slug).exists():
+        raise Http404
+    attach_cache_versions(talks)
     return direct_to_template(request, 'core/talks_speaker.html', {'talks': talks})
+
+
+@anonymous_cache
+def search(request):
+    query = request.GET.get('q', '')
+    results = search_index.search(query)
+    objects = {
+        'talk': Talk.objects.in_bulk(
+            [pk for kind, pk, score in results if kind == 'talk']),
+        'speaker': Speaker.objects.in_bulk(
+            [pk for kind, pk, score in results if kind == 'speaker']),
+    }
+    # mantem a ordem de relevancia do indice
+    found = [(kind, objects[kind][pk]) for kind, pk, score in results
+             if pk in objects[kind]]
+    context = {
+        'query': query,
+        'talks': [obj for kind, obj in found if kind == 'talk'],
+        'speakers': [obj for kind, obj in found if kind == 'speaker'],
+    }
+    return direct_to_template(request, 'core/search.html', context)
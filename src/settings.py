@@ -24,9 +24,35 @@ DATABASES = {
         'PASSWORD': '',                  # Not used with sqlite3.
         'HOST': '',                      # Set to empty string for localhost. Not used with sqlite3.
         'PORT': '',                      # Set to empty string for default. Not used with sqlite3.
+        # a file, not :memory:, so tests can open one connection per thread
+        'TEST_NAME': PROJECT_DIR.child('test_database.db'),
     }
 }
 
+# SQLite tuned for concurrent requests (see src.core.db.sqlite3): WAL,
+# synchronous=NORMAL, a busy timeout, mmap and a larger page cache.
+if 'True' == os.environ.get('SQLITE_TUNED', 'False'):
+    DATABASES['default']['ENGINE'] = 'src.core.db.sqlite3'
+    SOUTH_DATABASE_ADAPTERS = {'default': 'south.db.sqlite3'}
+
+# PostgreSQL deployment (see src.core.db.postgresql). CONN_MAX_AGE keeps
+# each thread's connection across requests; POOL_SIZE > 0 shares a pool of
+# that many connections among the threads of each worker process.
+if 'DATABASE_NAME' in os.environ:
+    DATABASES['default'] = {
+        'ENGINE': 'src.core.db.postgresql',
+        'NAME': os.environ['DATABASE_NAME'],
+        'USER': os.environ.get('DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', ''),
+        'PORT': os.environ.get('DATABASE_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+        'CONN_CHECK_AFTER': int(os.environ.get('DATABASE_CONN_CHECK_AFTER', 30)),
+        'POOL_SIZE': int(os.environ.get('DATABASE_POOL_SIZE', 0)),
+        'POOL_TIMEOUT': int(os.environ.get('DATABASE_POOL_TIMEOUT', 5)),
+    }
+    SOUTH_DATABASE_ADAPTERS = {'default': 'south.db.postgresql_psycopg2'}
+
 # project email config
 DEFAULT_FROM_EMAIL = 'contato.apceventex@gmail.com'
 if 'True' == os.environ.get('SEND_EMAIL', 'False'):
@@ -39,6 +65,34 @@ if 'True' == os.environ.get('SEND_EMAIL', 'False'):
 else:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# The page cache and the version keys that invalidate it, the cached talk
+# snippets, the speaker talks map and the search index must be shared by all
+# worker processes. LocMemCache is per process and only fits a single
+# process (runserver, tests); deployments with more workers must set
+# MEMCACHED_LOCATION (e.g. 127.0.0.1:11211).
+if 'MEMCACHED_LOCATION' in os.environ:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Part of every ETag (see src.core.views.make_etag): set it to the release
+# or commit id. Without it the ETags use a hash of the templates and of the
+# static files manifest.
+DEPLOY_VERSION = os.environ.get('DEPLOY_VERSION', '')
+
+# public pages cache (see src.core.cache.anonymous_cache)
+PUBLIC_CACHE_TIMEOUT = 60
+PUBLIC_CACHE_STALE = 600
+
 # Local time zone for this installation. Choices can be found here:
 # http://en.wikipedia.org/wiki/List_of_tz_zones_by_name
 # although not all choices may be available on all operating systems.
@@ -80,6 +134,10 @@ MEDIA_URL = '/media/'
 # Example: "/home/media/media.lawrence.com/static/"
 STATIC_ROOT = PROJECT_DIR.child('public')
 
+# Directory where the prerender_site command writes the public pages, so
+# nginx can serve them from disk (see src.core.prerender).
+PRERENDER_ROOT = PROJECT_DIR.child('html')
+
 # URL prefix for static files.
 # Example: "http://media.lawrence.com/static/"
 STATIC_URL = '/static/'
@@ -92,6 +150,10 @@ STATICFILES_DIRS = (
     (PROJECT_DIR.child('static'),)
 )
 
+# collectstatic writes content-hashed names, .gz/.br copies and a manifest
+# that the static template tag reads from memory (see src.core.storage).
+STATICFILES_STORAGE = 'src.core.storage.ManifestStaticFilesStorage'
+
 # List of finder classes that know how to find static files in
 # various locations.
 STATICFILES_FINDERS = (
@@ -111,6 +173,7 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'src.core.middleware.CompressionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -1,29 +1,105 @@
 # coding: utf-8
 
-from django.utils.datetime_safe import datetime
+import csv
+import operator
+import re
+from django.utils import timezone
 from django.contrib import admin
-from .models import Subscription
+from django.contrib.admin.views.main import ChangeList
+from django.db import connection
+from .models import Subscription, OutboxMessage, PaidUpdate, DailySubscriptionCount
+from django.db.models import Sum, Q
+from django.views.generic.simple import direct_to_template
 from django.utils.translation import ungettext, ugettext as _
 from django.conf.urls import patterns, url
 from django.http import HttpResponse
 
 
+class Echo(object):
+    """Arquivo falso que devolve o que o csv.writer escreve"""
+    def write(self, value):
+        return value
+
+
+class SubscriptionChangeList(ChangeList):
+    """Troca a busca padrao, um OR de LIKEs, pela busca do SubscriptionAdmin"""
+    def get_query_set(self, request):
+        query, self.query = self.query, ''
+        try:
+            qs = super(SubscriptionChangeList, self).get_query_set(request)
+        finally:
+            self.query = query
+        if query.strip():
+            qs = qs.filter(self.model_admin.search_lookup(query))
+        return qs
+
+
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('name', 'email', 'phone', 'created_at', 'subscribed_today', 'paid')
     date_hierarchy = 'created_at'
-    search_fields = ('name', 'cpf', 'email', 'phone', 'created_at')
+    search_fields = ('name', 'cpf', 'email', 'phone')
     list_filter = ['created_at']
 
+    cpf_re = re.compile(r'^\d{3}\.?\d{3}\.?\d{3}-?\d{2}$')
+    phone_re = re.compile(r'^\(?(\d{2})\)?[ -]?(\d{4,5}-?\d{4})$')
+
     actions = ['mark_as_paid']
 
+    export_fields = ('name', 'email')
+    export_optional_fields = ('cpf', 'phone', 'created_at', 'paid')
+    export_chunk_size = 2000
+    paid_chunk_size = 1000
+
+    def queryset(self, request):
+        """Calcula subscribed_today no banco em vez de linha a linha"""
+        qs = super(SubscriptionAdmin, self).queryset(request)
+        today = timezone.localtime(timezone.now())
+        today = today.replace(hour=0, minute=0, second=0, microsecond=0)
+        column = '%s.%s' % (
+            connection.ops.quote_name(self.model._meta.db_table),
+            connection.ops.quote_name('created_at'))
+        return qs.extra(
+            select={'is_subscribed_today': '%s >= %%s' % column},
+            select_params=(today,))
+
+    def get_changelist(self, request, **kwargs):
+        return SubscriptionChangeList
+
+    def search_lookup(self, query):
+        """
+        Filtro da busca conforme o formato do texto: CPF, email e telefone
+        vao para buscas exatas ou por prefixo em colunas indexadas e
+        somente o resto vira LIKE, apenas no nome. So digitos que formam
+        tanto um CPF quanto um telefone buscam nas duas colunas. O email
+        e buscado exato, nao por parte do endereco.
+        """
+        query = query.strip()
+        if '@' in query:
+            return Q(email=query)
+        lookups = []
+        if self.cpf_re.match(query):
+            lookups.append(Q(cpf=re.sub(r'\D', '', query)))
+        phone = self.phone_re.match(query)
+        if phone:
+            lookups.append(Q(phone='%s-%s' % (phone.group(1), phone.group(2).replace('-', ''))))
+        if lookups:
+            return reduce(operator.or_, lookups)
+        if query.isdigit():
+            return Q(cpf__startswith=query)
+        if re.match(r'^\d{2}-\d+$', query):
+            return Q(phone__startswith=query)
+        return Q(name__icontains=query)
+
     def subscribed_today(self, obj):
-        return obj.created_at.date() == datetime.today().date()
+        return bool(obj.is_subscribed_today)
 
     subscribed_today.short_description = u'Inscrito hoje?'
     subscribed_today.boolean = True
+    subscribed_today.admin_order_field = 'created_at'
 
     def mark_as_paid(self, request, queryset):
-        count = queryset.update(paid=True)
+        update = PaidUpdate.objects.start(queryset)
+        count = update.resume(chunk_size=self.paid_chunk_size)
 
         msg = ungettext(
             u'%(count)d inscrição foi marcada como paga.',
@@ -42,17 +118,75 @@ class SubscriptionAdmin(admin.ModelAdmin):
                 r'exportar-inscricoes/$',
                 self.admin_site.admin_view(self.export_subscriptions),
                 name='export_subscriptions'
+            ),
+            url(
+                r'estatisticas/$',
+                self.admin_site.admin_view(self.subscription_stats),
+                name='subscription_stats'
             )
         )
         return extra_url + original_urls
 
     def export_subscriptions(self, request):
-        subscriptions = self.model.objects.all()
-        rows = [','.join([s.name, s.email]) for s in subscriptions]
-
-        response = HttpResponse('\r\n'.join(rows), content_type='text/csv')
+        fields = self.get_export_fields(request)
+        response = HttpResponse(
+            self.iter_export_rows(fields), content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=inscricoes.csv'
         return response
 
+    def subscription_stats(self, request):
+        """Estatisticas lidas apenas dos contadores diarios"""
+        days = DailySubscriptionCount.objects.all()
+        today = days.filter(day=timezone.localtime(timezone.now()).date())
+        context = {
+            'title': _(u'Estatísticas das inscrições'),
+            'days': days,
+            'today': today and today[0] or None,
+            'totals': days.aggregate(
+                subscriptions=Sum('subscriptions'), paid=Sum('paid')),
+        }
+        return direct_to_template(
+            request, 'admin/subscriptions/subscription_stats.html', context)
+
+    def get_export_fields(self, request):
+        """Campos fixos mais os opcionais pedidos em ?campos=cpf,phone"""
+        wanted = request.GET.get('campos', '').split(',')
+        optional = [f for f in self.export_optional_fields if f in wanted]
+        return list(self.export_fields) + optional
+
+    def iter_export_rows(self, fields):
+        """
+        Gera o csv em blocos lidos por faixa de pk, carregando apenas as
+        colunas exportadas, para que a memoria nao cresca com a tabela.
+        """
+        writer = csv.writer(Echo())
+        yield writer.writerow(fields)
+
+        last_pk = 0
+        while True:
+            qs = self.model.objects.filter(pk__gt=last_pk).order_by('pk')
+            rows = list(qs.values_list('pk', *fields)[:self.export_chunk_size])
+            if not rows:
+                break
+            yield ''.join(
+                writer.writerow(map(self.export_value, fields, row[1:]))
+                for row in rows)
+            last_pk = rows[-1][0]
+
+    def export_value(self, field, value):
+        if field == 'created_at':
+            value = timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('recipient', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ['status']
+
 
 admin.site.register(Subscription, SubscriptionAdmin)
+admin.site.register(OutboxMessage, OutboxMessageAdmin)
@@ -0,0 +1,107 @@
+# coding: utf-8
+
+import numpy as np
+from django.contrib.localflavor.br.forms import BRCPFField
+from django.core.exceptions import ValidationError
+
+
+VALID = 0
+REQUIRED = 1
+MIN_LENGTH = 2
+MAX_LENGTH = 3
+DIGITS_ONLY = 4
+MAX_DIGITS = 5
+INVALID = 6
+
+REASONS = (
+    (VALID, u'valido'),
+    (REQUIRED, u'obrigatorio'),
+    (MIN_LENGTH, u'menos de 11 caracteres'),
+    (MAX_LENGTH, u'mais de 14 caracteres'),
+    (DIGITS_ONLY, u'apenas numeros'),
+    (MAX_DIGITS, u'mais de 11 digitos'),
+    (INVALID, u'digito verificador invalido'),
+)
+
+FIRST_WEIGHTS = np.arange(10, 1, -1)
+SECOND_WEIGHTS = np.arange(11, 1, -1)
+
+
+def check_digit(total):
+    rest = total % 11
+    return np.where(rest >= 2, 11 - rest, 0)
+
+
+def scalar_reason(value, field=None):
+    """Motivo da recusa de um CPF pelo proprio BRCPFField"""
+    field = field or BRCPFField()
+    try:
+        field.clean(value)
+    except ValidationError, e:
+        if value and len(value) < field.min_length:
+            return MIN_LENGTH
+        if len(value) > field.max_length:
+            return MAX_LENGTH
+        for key, code in (('required', REQUIRED),
+                          ('digits_only', DIGITS_ONLY),
+                          ('max_digits', MAX_DIGITS)):
+            if unicode(field.error_messages[key]) in e.messages:
+                return code
+        return INVALID
+    except ValueError:
+        # int() aceita espacos e sinal, mas o calculo dos digitos falha
+        return DIGITS_ONLY
+    return VALID
+
+
+def validate_cpfs(values):
+    """
+    Valida um lote de CPFs de uma vez, com as mesmas regras do BRCPFField.
+
+    Retorna (mask, reasons): mask indica os CPFs validos e reasons o codigo
+    de REASONS de cada entrada. Os digitos verificadores sao calculados
+    com numpy para o lote inteiro; apenas entradas fora do padrao, como
+    digitos nao ASCII, passam pelo BRCPFField uma a uma.
+    """
+    values = np.asarray(values, dtype=np.unicode_)
+    if values.ndim != 1:
+        values = values.ravel()
+    reasons = np.zeros(len(values), dtype=np.int8)
+    if not len(values):
+        return reasons == VALID, reasons
+
+    lengths = np.char.str_len(values)
+    stripped = np.char.replace(np.char.replace(values, u'-', u''), u'.', u'')
+    digit_count = np.char.str_len(stripped)
+
+    codes = stripped.view(np.uint32)
+    codes = codes.reshape(len(values), -1)
+    width = codes.shape[1]
+    filled = np.arange(width) < digit_count[:, np.newaxis]
+    ascii_digits = ((codes >= 48) & (codes <= 57)) | ~filled
+    ascii_digits = ascii_digits.all(axis=1) & (digit_count > 0)
+
+    reasons[lengths > 14] = MAX_LENGTH
+    reasons[lengths < 11] = MIN_LENGTH
+    reasons[lengths == 0] = REQUIRED
+
+    checked = (reasons == VALID) & ascii_digits
+    reasons[checked & (digit_count != 11)] = MAX_DIGITS
+    checked &= digit_count == 11
+
+    if checked.any():
+        digits = codes[checked, :11].astype(np.int64) - 48
+        first = check_digit(digits[:, :9].dot(FIRST_WEIGHTS))
+        second = check_digit(
+            digits[:, :9].dot(SECOND_WEIGHTS[:9]) + first * SECOND_WEIGHTS[9])
+        ok = (first == digits[:, 9]) & (second == digits[:, 10])
+        reasons[np.flatnonzero(checked)[~ok]] = INVALID
+
+    # entradas com caracteres fora de [0-9.-] seguem pelo BRCPFField
+    pending = (reasons == VALID) & ~ascii_digits
+    if pending.any():
+        field = BRCPFField()
+        for idx in np.flatnonzero(pending):
+            reasons[idx] = scalar_reason(values[idx], field)
+
+    return reasons == VALID, reasons
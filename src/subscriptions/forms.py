@@ -53,12 +53,27 @@ class SubscriptionForm(forms.ModelForm):
     phone = PhoneField(label=_('Telefone'), required=False)
 
     def _unique_check(self, fieldname, error_message):
-        param = {fieldname: self.cleaned_data[fieldname]}
-        try:
-            s = Subscription.objects.get(**param)
-        except Subscription.DoesNotExist:
-            return self.cleaned_data[fieldname]
-        raise forms.ValidationError(error_message)
+        value = self.cleaned_data[fieldname]
+        if value in EMPTY_VALUES:
+            return value
+        if Subscription.objects.filter(**{fieldname: value}).exists():
+            raise forms.ValidationError(error_message)
+        return value
+
+    def set_integrity_error(self):
+        """
+        Converte a violacao de unicidade de uma inscricao concorrente, que
+        passou pela validacao ao mesmo tempo, em erro do campo repetido.
+        Retorna False se nenhum campo estiver repetido.
+        """
+        for fieldname, message in (('cpf', _(u'CPF já inscrito.')),
+                                   ('email', _(u'E-mail já inscrito.'))):
+            try:
+                self._unique_check(fieldname, message)
+            except forms.ValidationError, e:
+                self._errors[fieldname] = self.error_class(e.messages)
+                return True
+        return False
 
     def clean_email(self):
         return self._unique_check('email', _(u'E-mail já inscrito.'))
@@ -0,0 +1,63 @@
+# coding: utf-8
+
+import random
+from optparse import make_option
+from timeit import default_timer
+from django.contrib.localflavor.br.forms import BRCPFField
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from src.subscriptions.cpf import validate_cpfs
+
+
+def make_cpf(rng):
+    """CPF aleatorio; metade dos gerados tem digitos verificadores corretos"""
+    digits = [rng.randint(0, 9) for i in range(9)]
+    if rng.random() < 0.5:
+        return u''.join(str(rng.randint(0, 9)) for i in range(11))
+    for weights in (range(10, 1, -1), range(11, 1, -1)):
+        rest = sum(w * d for w, d in zip(weights, digits)) % 11
+        digits.append(rest >= 2 and 11 - rest or 0)
+    return u''.join(map(str, digits))
+
+
+class Command(BaseCommand):
+    help = (u'Compara a validacao de CPFs linha a linha pelo BRCPFField com '
+            u'a validacao em lote do validate_cpfs.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=200000,
+            help=u'Quantidade de CPFs gerados.'),
+        make_option('--seed', type='int', default=0,
+            help=u'Semente do gerador de CPFs.'),
+    )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        cpfs = [make_cpf(rng) for i in xrange(options['rows'])]
+
+        field = BRCPFField()
+        start = default_timer()
+        expected = []
+        for cpf in cpfs:
+            try:
+                field.clean(cpf)
+            except ValidationError:
+                expected.append(False)
+            else:
+                expected.append(True)
+        per_row = default_timer() - start
+
+        start = default_timer()
+        mask, reasons = validate_cpfs(cpfs)
+        batch = default_timer() - start
+
+        if mask.tolist() != expected:
+            raise CommandError(u'validate_cpfs diverge do BRCPFField')
+
+        rows = len(cpfs)
+        self.stdout.write(u'%d CPFs, %d validos\n' % (rows, sum(expected)))
+        self.stdout.write(u'BRCPFField:    %.3fs (%d/s)\n' % (
+            per_row, rows / max(per_row, 1e-9)))
+        self.stdout.write(u'validate_cpfs: %.3fs (%d/s)\n' % (
+            batch, rows / max(batch, 1e-9)))
+        self.stdout.write(u'%.1fx mais rapido\n' % (per_row / max(batch, 1e-9)))
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+import threading
+import time
+from optparse import make_option
+from timeit import default_timer
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction, DatabaseError
+from src.subscriptions.models import (Subscription, PaidUpdate,
+    DailySubscriptionCount, count_by_day)
+
+
+class Command(BaseCommand):
+    help = (u'Mede a latencia de novas inscricoes enquanto a marcacao de '
+            u'pagamento roda em um unico update e em blocos.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=200000,
+            help=u'Inscricoes sinteticas a marcar como pagas.'),
+        make_option('--chunk-size', type='int', default=1000,
+            help=u'Inscricoes por transacao no modo em blocos.'),
+        make_option('--interval', type='float', default=0.01,
+            help=u'Segundos entre as inscricoes concorrentes.'),
+    )
+
+    prefix = u'8'
+
+    def handle(self, *args, **options):
+        self.inserted = 0
+        last_subscription = self.last_pk(Subscription)
+        last_update = self.last_pk(PaidUpdate)
+        try:
+            self.load(last_subscription, options['rows'])
+            # so as inscricoes carregadas aqui sao marcadas; as concorrentes ficam de fora
+            self.synthetic = Subscription.objects.filter(
+                pk__gt=last_subscription, pk__lte=self.last_pk(Subscription))
+            for mode in ('update', 'chunks'):
+                self.reset()
+                latencies, errors, elapsed = self.measure(
+                    mode, options['chunk_size'], options['interval'])
+                self.report(mode, latencies, errors, elapsed)
+        finally:
+            # a remocao passa pelo post_delete, que desconta os dias
+            Subscription.objects.filter(pk__gt=last_subscription).delete()
+            PaidUpdate.objects.filter(pk__gt=last_update).delete()
+            transaction.commit_unless_managed()
+
+    def last_pk(self, model):
+        last = model.objects.order_by('-pk')[:1]
+        return last and last[0].pk or 0
+
+    def load(self, first, rows):
+        for start in xrange(first, first + rows, 5000):
+            batch = [
+                Subscription(name=u'Inscrito %d' % i, cpf=u'%s%010d' % (self.prefix, i),
+                             email=u'inscrito%d@example.com' % i)
+                for i in xrange(start, min(start + 5000, first + rows))]
+            Subscription.objects.bulk_create(batch)
+            DailySubscriptionCount.objects.add(
+                count_by_day((s.created_at, s.paid) for s in batch))
+        transaction.commit_unless_managed()
+
+    def paid_days(self, qs, paid):
+        """Ajuste dos contadores de pagas ao mudar paid das inscricoes de qs"""
+        days = count_by_day(
+            (created_at, True) for created_at in qs.values_list('created_at', flat=True))
+        for counts in days.values():
+            counts[0] = 0
+            if not paid:
+                counts[1] = -counts[1]
+        return days
+
+    @transaction.commit_on_success
+    def reset(self):
+        paid = self.synthetic.filter(paid=True)
+        DailySubscriptionCount.objects.add(self.paid_days(paid, False))
+        paid.update(paid=False)
+
+    def mark_as_paid(self, mode, chunk_size):
+        qs = self.synthetic.filter(paid=False)
+        try:
+            if mode == 'update':
+                with transaction.commit_on_success():
+                    DailySubscriptionCount.objects.add(self.paid_days(qs, True))
+                    qs.update(paid=True)
+            else:
+                PaidUpdate.objects.start(qs).resume(chunk_size=chunk_size)
+        finally:
+            connection.close()
+
+    def measure(self, mode, chunk_size, interval):
+        worker = threading.Thread(target=self.mark_as_paid, args=(mode, chunk_size))
+        latencies, errors = [], 0
+        start = default_timer()
+        worker.start()
+        while worker.is_alive():
+            self.inserted += 1
+            before = default_timer()
+            try:
+                with transaction.commit_on_success():
+                    Subscription.objects.create(
+                        name=u'Concorrente', cpf=u'%s9%09d' % (self.prefix, self.inserted))
+            except DatabaseError:
+                errors += 1
+            latencies.append(default_timer() - before)
+            time.sleep(interval)
+        worker.join()
+        return latencies, errors, default_timer() - start
+
+    def report(self, mode, latencies, errors, elapsed):
+        latencies.sort()
+        def pick(p):
+            if not latencies:
+                return 0
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+        self.stdout.write(
+            u'%-7s %.2fs: %d inscricoes, %d erros, p50 %.1fms, '
+            u'p99 %.1fms, max %.1fms\n' % (
+                mode, elapsed, len(latencies), errors,
+                pick(0.5), pick(0.99), pick(1)))
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+import csv
+from optparse import make_option
+from django import forms
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from src.subscriptions.forms import SubscriptionForm
+from src.subscriptions.models import Subscription, DailySubscriptionCount, count_by_day
+
+
+class Command(BaseCommand):
+    args = '<arquivo.csv>'
+    help = (u'Importa inscricoes de um csv com as colunas name, cpf, email e '
+            u'phone, validando como o SubscriptionForm e inserindo em lotes.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=5000,
+            help=u'Quantidade de inscricoes por insert.'),
+        make_option('--rejects', default=None,
+            help=u'Arquivo csv onde gravar as linhas recusadas '
+                 u'(padrao: <arquivo>.rejeitados.csv).'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError(u'Informe o arquivo csv.')
+        path = args[0]
+        rejects_path = options['rejects'] or path + '.rejeitados.csv'
+        batch_size = options['batch_size']
+
+        self.fields = SubscriptionForm.base_fields
+        self.cpfs = set(Subscription.objects.values_list('cpf', flat=True))
+        self.emails = set(Subscription.objects.exclude(email='')
+                          .values_list('email', flat=True))
+
+        imported = rejected = 0
+        batch = []
+        with open(path, 'rb') as source, open(rejects_path, 'wb') as rejects:
+            reader = csv.DictReader(source)
+            writer = csv.writer(rejects)
+            writer.writerow(['linha', 'erro'] + reader.fieldnames)
+
+            for line, row in enumerate(reader, 2):
+                try:
+                    batch.append(self.make_subscription(row))
+                except forms.ValidationError, e:
+                    writer.writerow([line, '; '.join(e.messages).encode('utf-8')] +
+                                    [row.get(f) for f in reader.fieldnames])
+                    rejected += 1
+
+                if len(batch) >= batch_size:
+                    imported += self.insert(batch)
+                    batch = []
+            imported += self.insert(batch)
+
+        self.stdout.write(u'%d inscricoes importadas, %d recusadas (%s)\n' % (
+            imported, rejected, rejects_path))
+
+    def make_subscription(self, row):
+        """Valida a linha com os mesmos campos do SubscriptionForm"""
+        value = lambda key: (row.get(key) or '').decode('utf-8').strip()
+
+        name = self.fields['name'].clean(value('name'))
+        cpf = self.fields['cpf'].clean(value('cpf'))
+        email = self.fields['email'].clean(value('email'))
+        phone = value('phone')
+        phone = self.fields['phone'].clean(phone and phone.split('-', 1))
+
+        if not email and not phone:
+            raise forms.ValidationError(u'Informe seu e-mail ou telefone.')
+        if cpf in self.cpfs:
+            raise forms.ValidationError(u'CPF já inscrito.')
+        if email and email in self.emails:
+            raise forms.ValidationError(u'E-mail já inscrito.')
+
+        self.cpfs.add(cpf)
+        if email:
+            self.emails.add(email)
+        return Subscription(name=name, cpf=cpf, email=email, phone=phone)
+
+    @transaction.commit_on_success
+    def insert(self, batch):
+        Subscription.objects.bulk_create(batch)
+        # o bulk_create nao dispara post_save
+        DailySubscriptionCount.objects.add(
+            count_by_day((s.created_at, s.paid) for s in batch))
+        return len(batch)
@@ -0,0 +1,12 @@
+# coding: utf-8
+
+from django.core.management.base import BaseCommand
+from src.subscriptions.models import DailySubscriptionCount
+
+
+class Command(BaseCommand):
+    help = u'Recalcula os contadores diarios de inscricoes.'
+
+    def handle(self, *args, **options):
+        days = DailySubscriptionCount.objects.rebuild()
+        self.stdout.write(u'%d dias recalculados\n' % days)
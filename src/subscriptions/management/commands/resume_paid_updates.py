@@ -0,0 +1,19 @@
+# coding: utf-8
+
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from src.subscriptions.models import PaidUpdate
+
+
+class Command(BaseCommand):
+    help = u'Conclui as marcacoes de pagamento interrompidas.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--chunk-size', type='int', default=1000,
+            help=u'Inscricoes atualizadas por transacao.'),
+    )
+
+    def handle(self, *args, **options):
+        for update in PaidUpdate.objects.unfinished():
+            count = update.resume(chunk_size=options['chunk_size'])
+            self.stdout.write(u'Marcacao %d: %d inscricoes\n' % (update.pk, count))
@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import time
+from datetime import timedelta
+from optparse import make_option
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from src.subscriptions.models import OutboxMessage
+
+
+class Command(BaseCommand):
+    help = (u'Envia os emails pendentes em lotes, reaproveitando uma unica '
+            u'conexao SMTP, com retentativas e backoff exponencial.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=100,
+            help=u'Quantidade de emails por lote.'),
+        make_option('--max-attempts', type='int', default=5,
+            help=u'Tentativas antes de descartar o email.'),
+        make_option('--backoff', type='int', default=60,
+            help=u'Segundos de espera apos a primeira falha.'),
+        make_option('--loop', action='store_true', default=False,
+            help=u'Continua drenando a fila indefinidamente.'),
+        make_option('--interval', type='int', default=5,
+            help=u'Segundos entre verificacoes da fila com --loop.'),
+        make_option('--keep-days', type='int', default=30,
+            help=u'Dias que os emails enviados ficam guardados.'),
+    )
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = self.drain(
+                options['batch_size'],
+                options['max_attempts'],
+                options['backoff'])
+            if sent or failed:
+                self.stdout.write(
+                    u'%d enviados, %d falharam\n' % (sent, failed))
+            purged = OutboxMessage.objects.purge_sent(
+                timezone.now() - timedelta(days=options['keep_days']))
+            if purged:
+                self.stdout.write(u'%d enviados apagados\n' % purged)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def drain(self, batch_size, max_attempts, backoff):
+        """Envia lotes ate a fila de emails prontos esvaziar"""
+        sent = failed = 0
+        connection = get_connection()
+        try:
+            while True:
+                batch_sent, batch_failed = self.send_batch(
+                    connection, batch_size, max_attempts, backoff)
+                sent += batch_sent
+                failed += batch_failed
+                if batch_sent + batch_failed < batch_size:
+                    break
+        finally:
+            connection.close()
+        return sent, failed
+
+    @transaction.commit_on_success
+    def send_batch(self, connection, batch_size, max_attempts, backoff):
+        messages = OutboxMessage.objects.ready().select_for_update()
+        sent = failed = 0
+        for outbox in messages[:batch_size]:
+            email = EmailMessage(
+                subject=outbox.subject,
+                body=outbox.message,
+                from_email=outbox.from_email,
+                to=[outbox.recipient],
+                connection=connection)
+            try:
+                connection.open()
+                email.send()
+            except Exception, e:
+                outbox.mark_failed(unicode(e), max_attempts, backoff)
+                connection.close()
+                failed += 1
+            else:
+                outbox.mark_sent()
+                sent += 1
+        return sent, failed
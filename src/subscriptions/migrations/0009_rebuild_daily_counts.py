@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from django.utils import timezone
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Preenche os contadores diarios com as inscricoes existentes."
+        days = {}
+        rows = orm['subscriptions.Subscription'].objects.values_list('created_at', 'paid')
+        for created_at, paid in rows.iterator():
+            if timezone.is_aware(created_at):
+                created_at = timezone.localtime(created_at)
+            counts = days.setdefault(created_at.date(), [0, 0])
+            counts[0] += 1
+            counts[1] += paid and 1 or 0
+
+        orm['subscriptions.DailySubscriptionCount'].objects.all().delete()
+        for day, (subscriptions, paid) in days.items():
+            orm['subscriptions.DailySubscriptionCount'].objects.create(
+                day=day, subscriptions=subscriptions, paid=paid)
+
+    def backwards(self, orm):
+        "Os contadores sao removidos junto com a tabela."
+        orm['subscriptions.DailySubscriptionCount'].objects.all().delete()
+
+    models = {
+        'subscriptions.dailysubscriptioncount': {
+            'Meta': {'ordering': "['-day']", 'object_name': 'DailySubscriptionCount'},
+            'day': ('django.db.models.fields.DateField', [], {'unique': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'paid': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'subscriptions': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        },
+        'subscriptions.outboxmessage': {
+            'Meta': {'ordering': "['created_at']", 'object_name': 'OutboxMessage'},
+            'attempts': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'from_email': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'blank': 'True'}),
+            'message': ('django.db.models.fields.TextField', [], {}),
+            'next_attempt_at': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime.now'}),
+            'recipient': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'sent_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "'P'", 'max_length': '1'}),
+            'subject': ('django.db.models.fields.CharField', [], {'max_length': '255'})
+        },
+        'subscriptions.paidupdate': {
+            'Meta': {'ordering': "['created_at']", 'object_name': 'PaidUpdate'},
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'fingerprint': ('django.db.models.fields.CharField', [], {'max_length': '40', 'db_index': 'True'}),
+            'finished_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_pk': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'selection': ('django.db.models.fields.TextField', [], {}),
+            'updated': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'subscriptions.subscription': {
+            'Meta': {'ordering': "['created_at']", 'object_name': 'Subscription'},
+            'cpf': ('django.db.models.fields.CharField', [], {'unique': 'True', 'max_length': '11'}),
+            'created_at': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'email': ('django.db.models.fields.EmailField', [], {'db_index': 'True', 'max_length': '75', 'blank': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'paid': ('django.db.models.fields.BooleanField', [], {'default': 'False'}),
+            'phone': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '20', 'blank': 'True'})
+        }
+    }
+
+    complete_apps = ['subscriptions']
+    symmetrical = True
\ No newline at end of file
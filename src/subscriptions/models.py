@@ -1,15 +1,22 @@
 # coding: utf-8
 
-from django.db import models
+from datetime import timedelta
+from hashlib import sha1
+from itertools import islice
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
 
 class Subscription(models.Model):
 
     name = models.CharField('Nome', max_length=100)
     cpf = models.CharField('CPF', max_length=11, unique=True)
-    email = models.EmailField('E-mail', blank=True)
-    phone = models.CharField('Telefone', max_length=20, blank=True)
-    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+    email = models.EmailField('E-mail', blank=True, db_index=True)
+    phone = models.CharField('Telefone', max_length=20, blank=True, db_index=True)
+    created_at = models.DateTimeField('Criado em', auto_now_add=True, db_index=True)
     paid = models.BooleanField()
 
     def __unicode__(self):
@@ -19,3 +26,276 @@ class Subscription(models.Model):
         ordering = ["created_at"]
         verbose_name = u"Inscrição"
         verbose_name_plural = u"Inscrições"
+
+
+class OutboxManager(models.Manager):
+    """Fila de emails a enviar fora do request"""
+    def enqueue(self, subject, message, recipient, from_email):
+        return self.create(
+            subject=subject,
+            message=message,
+            recipient=recipient,
+            from_email=from_email)
+
+    def ready(self, now=None):
+        # servido pelo indice (status, next_attempt_at) da migracao 0005
+        qs = self.filter(
+            status=OutboxMessage.PENDING,
+            next_attempt_at__lte=now or timezone.now())
+        return qs.order_by('next_attempt_at', 'pk')
+
+    def purge_sent(self, before):
+        """Apaga os emails enviados antes de before e devolve quantos eram"""
+        qs = self.filter(status=OutboxMessage.SENT, sent_at__lt=before)
+        count = qs.count()
+        qs.delete()
+        return count
+
+
+class OutboxMessage(models.Model):
+    """Email pendente de envio, gravado na mesma transação da inscrição"""
+    PENDING = 'P'
+    SENT = 'S'
+    DEAD = 'D'
+    STATUSES = (
+        (PENDING, u'Pendente'),
+        (SENT, u'Enviado'),
+        (DEAD, u'Descartado'),
+    )
+
+    subject = models.CharField('Assunto', max_length=255)
+    message = models.TextField('Mensagem')
+    from_email = models.CharField('Remetente', max_length=255)
+    recipient = models.CharField(u'Destinatário', max_length=255)
+    status = models.CharField(
+        'Status', max_length=1, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveIntegerField('Tentativas', default=0)
+    next_attempt_at = models.DateTimeField(
+        u'Próxima tentativa', default=timezone.now)
+    last_error = models.TextField(u'Último erro', blank=True)
+    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+    sent_at = models.DateTimeField('Enviado em', blank=True, null=True)
+
+    objects = OutboxManager()
+
+    def __unicode__(self):
+        return u'%s - %s' % (self.recipient, self.subject)
+
+    def mark_sent(self):
+        self.status = self.SENT
+        self.attempts += 1
+        self.sent_at = timezone.now()
+        self.last_error = ''
+        self.save()
+
+    def mark_failed(self, error, max_attempts, backoff):
+        """Agenda nova tentativa com backoff exponencial ou descarta"""
+        self.attempts += 1
+        self.last_error = error
+        if self.attempts >= max_attempts:
+            self.status = self.DEAD
+        else:
+            delay = backoff * 2 ** (self.attempts - 1)
+            self.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        self.save()
+
+    class Meta:
+        ordering = ["created_at"]
+        verbose_name = u"Email pendente"
+        verbose_name_plural = u"Emails pendentes"
+
+
+class PaidUpdateManager(models.Manager):
+    def start(self, queryset):
+        """
+        Registra a marcacao de pagamento de uma selecao, ou devolve a
+        execucao interrompida da mesma selecao para continuar de onde parou.
+        """
+        selection = pack_pks(queryset.order_by('pk').values_list('pk', flat=True))
+        fingerprint = sha1(selection).hexdigest()
+        unfinished = self.filter(fingerprint=fingerprint, finished_at=None)
+        for update in unfinished.order_by('-pk')[:1]:
+            return update
+        return self.create(fingerprint=fingerprint, selection=selection)
+
+    def unfinished(self):
+        return self.filter(finished_at=None).order_by('pk')
+
+
+class PaidUpdate(models.Model):
+    """
+    Progresso da marcacao de inscricoes como pagas, feita em blocos por
+    ordem de pk com transacoes curtas para nao travar novas inscricoes.
+    """
+    fingerprint = models.CharField(max_length=40, db_index=True)
+    # pks selecionados em faixas "inicio-fim" separadas por virgula
+    selection = models.TextField()
+    last_pk = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField('Criado em', auto_now_add=True)
+    finished_at = models.DateTimeField(u'Concluído em', blank=True, null=True)
+
+    objects = PaidUpdateManager()
+
+    def __unicode__(self):
+        return u'%s (%d)' % (self.created_at, self.updated)
+
+    def pending_pks(self):
+        """Pks da selecao depois de last_pk, em ordem"""
+        for start, end in unpack_pks(self.selection):
+            for pk in xrange(max(start, self.last_pk + 1), end + 1):
+                yield pk
+
+    def resume(self, chunk_size=1000):
+        """Processa os blocos restantes e devolve o total de inscricoes"""
+        pending = self.pending_pks()
+        while self.finished_at is None:
+            self.update_chunk(list(islice(pending, chunk_size)), chunk_size)
+        return self.updated
+
+    @transaction.commit_on_success
+    def update_chunk(self, pks, chunk_size):
+        if pks:
+            # inscricoes apagadas depois da selecao ficam de fora
+            rows = Subscription.objects.filter(pk__in=pks).values_list('created_at', 'paid')
+            days = count_by_day((created_at, True) for created_at, paid in rows if not paid)
+            Subscription.objects.filter(pk__in=pks, paid=False).update(paid=True)
+            for counts in days.values():
+                counts[0] = 0
+            DailySubscriptionCount.objects.add(days)
+            self.last_pk = pks[-1]
+            self.updated += len(rows)
+        if len(pks) < chunk_size:
+            self.finished_at = timezone.now()
+        self.save()
+
+    class Meta:
+        ordering = ["created_at"]
+        verbose_name = u"Marcação de pagamento"
+        verbose_name_plural = u"Marcações de pagamento"
+
+
+def pack_pks(pks):
+    """Pks em ordem como faixas "inicio-fim" separadas por virgula"""
+    ranges = []
+    for pk in pks:
+        if ranges and pk == ranges[-1][1] + 1:
+            ranges[-1][1] = pk
+        else:
+            ranges.append([pk, pk])
+    return ','.join('%d-%d' % (start, end) for start, end in ranges)
+
+
+def unpack_pks(selection):
+    """Faixas (inicio, fim) gravadas por pack_pks"""
+    for part in selection.split(','):
+        if part:
+            start, end = part.split('-')
+            yield int(start), int(end)
+
+
+def local_day(value):
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+def count_by_day(rows):
+    """Agrupa pares (created_at, paid) em {dia: [inscricoes, pagas]}"""
+    days = {}
+    for created_at, paid in rows:
+        counts = days.setdefault(local_day(created_at), [0, 0])
+        counts[0] += 1
+        counts[1] += paid and 1 or 0
+    return days
+
+
+class DailySubscriptionCountManager(models.Manager):
+    def add(self, days):
+        """Soma {dia: [inscricoes, pagas]} aos contadores de cada dia"""
+        for day, (subscriptions, paid) in days.items():
+            if not subscriptions and not paid:
+                continue
+            if self.increment(day, subscriptions, paid):
+                continue
+            sid = transaction.savepoint(self.db)
+            try:
+                self.create(day=day, subscriptions=subscriptions, paid=paid)
+            except IntegrityError:
+                # outra transacao criou o dia ao mesmo tempo
+                transaction.savepoint_rollback(sid, self.db)
+                self.increment(day, subscriptions, paid)
+            else:
+                transaction.savepoint_commit(sid, self.db)
+
+    def increment(self, day, subscriptions, paid):
+        return self.filter(day=day).update(
+            subscriptions=F('subscriptions') + subscriptions,
+            paid=F('paid') + paid)
+
+    @transaction.commit_on_success
+    def rebuild(self, chunk_size=5000):
+        """Recalcula todos os contadores a partir da tabela de inscricoes"""
+        days = {}
+        last_pk = 0
+        while True:
+            rows = list(Subscription.objects.filter(pk__gt=last_pk)
+                        .order_by('pk')
+                        .values_list('pk', 'created_at', 'paid')[:chunk_size])
+            if not rows:
+                break
+            for day, (subscriptions, paid) in count_by_day(
+                    (created_at, paid) for pk, created_at, paid in rows).items():
+                counts = days.setdefault(day, [0, 0])
+                counts[0] += subscriptions
+                counts[1] += paid
+            last_pk = rows[-1][0]
+
+        self.all().delete()
+        self.bulk_create([
+            DailySubscriptionCount(day=day, subscriptions=s, paid=p)
+            for day, (s, p) in sorted(days.items())])
+        return len(days)
+
+
+class DailySubscriptionCount(models.Model):
+    """
+    Total de inscricoes e de pagas por dia, mantido a cada inscricao
+    para que as estatisticas nao precisem varrer a tabela de inscricoes.
+    """
+    day = models.DateField('Dia', unique=True)
+    subscriptions = models.IntegerField(u'Inscrições', default=0)
+    paid = models.IntegerField('Pagas', default=0)
+
+    objects = DailySubscriptionCountManager()
+
+    def __unicode__(self):
+        return u'%s: %d' % (self.day, self.subscriptions)
+
+    class Meta:
+        ordering = ["-day"]
+        verbose_name = u"Inscrições por dia"
+        verbose_name_plural = u"Inscrições por dia"
+
+
+@receiver(post_init, sender=Subscription)
+def remember_paid(sender, instance, **kwargs):
+    instance._saved_paid = instance.paid
+
+
+@receiver(post_save, sender=Subscription)
+def count_saved_subscription(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    day = local_day(instance.created_at)
+    if created:
+        DailySubscriptionCount.objects.add({day: [1, int(instance.paid)]})
+    elif instance.paid != instance._saved_paid:
+        DailySubscriptionCount.objects.add({day: [0, instance.paid and 1 or -1]})
+    instance._saved_paid = instance.paid
+
+
+@receiver(post_delete, sender=Subscription)
+def count_deleted_subscription(sender, instance, **kwargs):
+    day = local_day(instance.created_at)
+    DailySubscriptionCount.objects.add({day: [-1, -int(instance._saved_paid)]})
@@ -1,12 +1,27 @@
 # coding: utf-8
 
 from django.core.urlresolvers import reverse as r
-from django.test import TestCase
-from .models import Subscription
+from django.test import TestCase, TransactionTestCase
+from django.test.client import Client
+from django.utils.unittest import skipIf
+from django.db import connection
+from threading import Thread
+import csv
+import os
+import shutil
+import tempfile
+from itertools import islice
+from .models import Subscription, OutboxMessage, PaidUpdate, DailySubscriptionCount
 from django.db import IntegrityError
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from StringIO import StringIO
+from datetime import timedelta
+from django.utils import timezone
 from .forms import SubscriptionForm
+from .cpf import validate_cpfs, scalar_reason, VALID, REQUIRED, MIN_LENGTH, MAX_DIGITS, DIGITS_ONLY, INVALID
 from django.core import mail
-from mock import Mock
+from mock import Mock, patch
 from .admin import SubscriptionAdmin, Subscription, admin
 from django.contrib.auth.models import User
 
@@ -91,9 +106,73 @@ class SubscribeViewPostTest(TestCase):
         "Post deve salvar Subscription no banco."
         self.assertTrue(Subscription.objects.exists())
 
+    def test_email_queued(self):
+        "Post deve agendar o email sem enviar durante o request."
+        self.assertEquals(0, len(mail.outbox))
+        self.assertEquals(1, OutboxMessage.objects.count())
+
     def test_email_sent(self):
-        "Post deve notificar visitante por email."
+        "O worker deve notificar visitante por email."
+        call_command('send_outbox', stdout=StringIO())
         self.assertEquals(1, len(mail.outbox))
+        self.assertEquals(['abnerpc@gmail.com'], mail.outbox[0].to)
+
+
+class FailingEmailBackend(EmailBackend):
+
+    def send_messages(self, messages):
+        raise IOError('SMTP fora do ar')
+
+
+class SendOutboxTest(TestCase):
+
+    def setUp(self):
+        for i in range(3):
+            OutboxMessage.objects.enqueue(
+                subject='Assunto', message='Mensagem',
+                recipient='inscrito%d@gmail.com' % i,
+                from_email='contato@eventex.com.br')
+
+    def send(self, **options):
+        call_command('send_outbox', stdout=StringIO(), **options)
+
+    def test_batches(self):
+        "Todos os lotes devem ser enviados."
+        self.send(batch_size=2)
+        self.assertEquals(3, len(mail.outbox))
+        self.assertFalse(OutboxMessage.objects.ready().exists())
+
+    def test_sent_once(self):
+        "Emails enviados não são reenviados."
+        self.send()
+        self.send()
+        self.assertEquals(3, len(mail.outbox))
+
+    def test_retry(self):
+        "Falhas são reagendadas com backoff."
+        with self.settings(EMAIL_BACKEND='src.subscriptions.tests.FailingEmailBackend'):
+            self.send(backoff=60)
+        outbox = OutboxMessage.objects.all()[0]
+        self.assertEquals(OutboxMessage.PENDING, outbox.status)
+        self.assertEquals(1, outbox.attempts)
+        self.assertTrue(outbox.next_attempt_at > timezone.now() + timedelta(seconds=50))
+        self.assertIn('SMTP fora do ar', outbox.last_error)
+
+    def test_dead_letter(self):
+        "Após o limite de tentativas o email é descartado."
+        with self.settings(EMAIL_BACKEND='src.subscriptions.tests.FailingEmailBackend'):
+            self.send(max_attempts=1)
+        self.assertEquals(3, OutboxMessage.objects.filter(status=OutboxMessage.DEAD).count())
+
+    def test_purge_sent(self):
+        "Emails enviados há mais tempo que o prazo são apagados."
+        self.send()
+        old = OutboxMessage.objects.all()[0]
+        OutboxMessage.objects.filter(pk=old.pk).update(
+            sent_at=timezone.now() - timedelta(days=31))
+        self.send(keep_days=30)
+        self.assertEquals(2, OutboxMessage.objects.count())
+        self.assertFalse(OutboxMessage.objects.filter(pk=old.pk).exists())
 
 
 class SubscribeViewInvalidPostTest(TestCase):
@@ -170,6 +249,116 @@ class CustomActionTest(TestCase):
         self.assertEqual(1, Subscription.objects.filter(paid=True).count())
 
 
+class SubscriptionChangeListTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        Subscription.objects.create(name='Abner Campanha', cpf='01234567890',
+            email='abnerpc@gmail.com', phone='12-34567890')
+        old = Subscription.objects.create(name='Maria', cpf='11111111111',
+            email='maria@gmail.com', phone='21-98765432')
+        Subscription.objects.filter(pk=old.pk).update(
+            created_at=timezone.now() - timedelta(days=2))
+        self.modeladmin = SubscriptionAdmin(Subscription, admin.site)
+
+    def search(self, q):
+        resp = self.client.get(r('admin:subscriptions_subscription_changelist'), {'q': q})
+        self.assertEqual(200, resp.status_code)
+        return [s.name for s in resp.context['cl'].result_list]
+
+    def test_search_lookup(self):
+        u'Busca usa consultas exatas ou por prefixo conforme o formato.'
+        lookup = lambda q: self.modeladmin.search_lookup(q).children
+        self.assertEqual([('cpf', '01234567890')], lookup('012.345.678-90'))
+        self.assertEqual([('cpf__startswith', '0123')], lookup('0123'))
+        self.assertEqual([('email', 'abnerpc@gmail.com')], lookup(' abnerpc@gmail.com '))
+        self.assertEqual([('phone', '12-34567890')], lookup('(12) 3456-7890'))
+        self.assertEqual([('phone', '12-34567890')], lookup('1234567890'))
+        self.assertEqual([('cpf', '21987654321'), ('phone', '21-987654321')],
+                         lookup('21987654321'))
+        self.assertEqual([('phone__startswith', '12-3456')], lookup('12-3456'))
+        self.assertEqual([('name__icontains', 'Abner')], lookup('Abner'))
+
+    def test_search(self):
+        u'Busca no changelist encontra pelo CPF, email, telefone e nome.'
+        self.assertEqual(['Abner Campanha'], self.search('01234567890'))
+        self.assertEqual(['Maria'], self.search('maria@gmail.com'))
+        self.assertEqual(['Maria'], self.search('21-98765432'))
+        self.assertEqual(['Maria'], self.search('2198765432'))
+        self.assertEqual(['Abner Campanha'], self.search('campanha'))
+
+    def test_subscribed_today(self):
+        u'Inscrito hoje é calculado pelo banco.'
+        qs = self.modeladmin.queryset(Mock()).order_by('pk')
+        self.assertEqual([True, False], [self.modeladmin.subscribed_today(s) for s in qs])
+
+    def test_action_on_changelist(self):
+        u'Ação de marcar como pago funciona sobre o queryset anotado.'
+        resp = self.client.post(r('admin:subscriptions_subscription_changelist'), {
+            'action': 'mark_as_paid',
+            '_selected_action': [s.pk for s in Subscription.objects.all()]})
+        self.assertEqual(302, resp.status_code)
+        self.assertEqual(2, Subscription.objects.filter(paid=True).count())
+
+
+class PaidUpdateTest(TestCase):
+
+    def setUp(self):
+        for i in range(5):
+            Subscription.objects.create(name='Inscrito %d' % i, cpf='%011d' % i,
+                email='inscrito%d@gmail.com' % i)
+        self.queryset = Subscription.objects.filter(email__startswith='inscrito')
+
+    def interrupt(self):
+        update = PaidUpdate.objects.start(self.queryset)
+        update.update_chunk(list(islice(update.pending_pks(), 2)), 2)
+        return update
+
+    def test_selection(self):
+        u'A seleção é gravada como faixas de pks.'
+        pks = list(self.queryset.order_by('pk').values_list('pk', flat=True))
+        Subscription.objects.filter(pk=pks[2]).delete()
+        update = PaidUpdate.objects.start(Subscription.objects.all())
+        self.assertEqual('%d-%d,%d-%d' % (pks[0], pks[1], pks[3], pks[4]), update.selection)
+        self.assertEqual(pks[:2] + pks[3:], list(update.pending_pks()))
+
+    def test_deleted_after_start(self):
+        u'Inscrições apagadas depois da seleção não são contadas.'
+        update = PaidUpdate.objects.start(self.queryset)
+        self.queryset.filter(cpf='00000000004').delete()
+        self.assertEqual(4, update.resume(chunk_size=2))
+
+    def test_chunks(self):
+        u'Todas as inscrições da seleção são marcadas, em blocos.'
+        update = PaidUpdate.objects.start(self.queryset)
+        self.assertEqual(5, update.resume(chunk_size=2))
+        self.assertEqual(5, Subscription.objects.filter(paid=True).count())
+        self.assertTrue(update.finished_at)
+
+    def test_resume(self):
+        u'Uma execução interrompida continua de onde parou.'
+        interrupted = self.interrupt()
+        self.assertEqual(2, Subscription.objects.filter(paid=True).count())
+        update = PaidUpdate.objects.start(self.queryset.order_by('-name'))
+        self.assertEqual(interrupted.pk, update.pk)
+        self.assertEqual(5, update.resume(chunk_size=2))
+        self.assertEqual(5, Subscription.objects.filter(paid=True).count())
+
+    def test_resume_command(self):
+        u'O comando conclui as execuções interrompidas.'
+        self.interrupt()
+        call_command('resume_paid_updates', stdout=StringIO())
+        self.assertEqual(5, Subscription.objects.filter(paid=True).count())
+        self.assertFalse(PaidUpdate.objects.unfinished().exists())
+
+    def test_new_selection(self):
+        u'Uma seleção diferente começa uma nova execução.'
+        interrupted = self.interrupt()
+        update = PaidUpdate.objects.start(Subscription.objects.filter(cpf='00000000004'))
+        self.assertNotEqual(interrupted.pk, update.pk)
+
+
 class ExportSubscriptionViewTest(TestCase):
 
     def setUp(self):
@@ -190,6 +379,42 @@ class ExportSubscriptionViewTest(TestCase):
         self.assertTrue('attachment;' in self.resp['Content-Disposition'])
 
 
+class ExportSubscriptionCsvTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        Subscription.objects.create(name=u'Campanha, Abner', cpf='01234567890',
+            email='abnerpc@gmail.com', phone='12-34567890')
+        Subscription.objects.create(name=u'João', cpf='01234567891',
+            email='joao@gmail.com', phone='12-34567891', paid=True)
+
+    def get_rows(self, **params):
+        resp = self.client.get(r('admin:export_subscriptions'), params)
+        return resp.content.splitlines()
+
+    def test_default_columns(self):
+        u'Exporta nome e email com cabeçalho e valores escapados.'
+        self.assertEqual([
+            'name,email',
+            '"Campanha, Abner",abnerpc@gmail.com',
+            u'João,joao@gmail.com'.encode('utf-8'),
+        ], self.get_rows())
+
+    def test_optional_columns(self):
+        u'Colunas opcionais são escolhidas pelo parâmetro campos.'
+        rows = self.get_rows(campos='cpf,paid,senha')
+        self.assertEqual('name,email,cpf,paid', rows[0])
+        self.assertTrue(rows[2].endswith(',01234567891,1'))
+
+    def test_chunks(self):
+        u'Todos os blocos são exportados.'
+        modeladmin = SubscriptionAdmin(Subscription, admin.site)
+        modeladmin.export_chunk_size = 1
+        chunks = list(modeladmin.iter_export_rows(['cpf']))
+        self.assertEqual(['cpf\r\n', '01234567890\r\n', '01234567891\r\n'], chunks)
+
+
 class ExportSubscriptionsNotFound(TestCase):
 
     def test_404(self):
@@ -221,6 +446,40 @@ class SubscriptionFormTest(TestCase):
         form = self.make_and_validade_form(email='', phone='')
         self.assertDictEqual(form.errors, {'__all__': [u'Informe seu e-mail ou telefone.']})
 
+    def test_email_already_subscribed(self):
+        u'Email já inscrito deve ser recusado.'
+        Subscription.objects.create(name='Abner Campanha', cpf='01234567890',
+            email='abnerpc@gmail.com')
+        form = self.make_and_validade_form()
+        self.assertEqual([u'E-mail já inscrito.'], form.errors['email'])
+
+    def test_empty_email_is_not_checked(self):
+        u'Várias inscrições sem email não impedem nova inscrição sem email.'
+        Subscription.objects.create(name='A', cpf='01234567890', phone='12-34567890')
+        Subscription.objects.create(name='B', cpf='01234567891', phone='12-34567891')
+        form = self.make_and_validade_form(email='', phone_0='12', phone_1='34567892')
+        self.assertTrue(form.is_valid())
+
+    def test_integrity_error_on_cpf(self):
+        u'Inscrição concorrente com o mesmo CPF vira erro no CPF.'
+        form = self.make_and_validade_form()
+        Subscription.objects.create(name='Outro', cpf='00000000000', phone='12-34567891')
+        self.assertTrue(form.set_integrity_error())
+        self.assertEqual({'cpf': [u'CPF já inscrito.']}, form.errors)
+
+    def test_integrity_error_on_email(self):
+        u'Inscrição concorrente com o mesmo email vira erro no email.'
+        form = self.make_and_validade_form()
+        Subscription.objects.create(name='Outro', cpf='01234567890', email='abnerpc@gmail.com')
+        self.assertTrue(form.set_integrity_error())
+        self.assertEqual({'email': [u'E-mail já inscrito.']}, form.errors)
+
+    def test_integrity_error_unknown(self):
+        u'Erro de integridade sem campo repetido não é atribuído a nenhum campo.'
+        form = self.make_and_validade_form()
+        self.assertFalse(form.set_integrity_error())
+        self.assertEqual({}, form.errors)
+
     def make_and_validade_form(self, **kwargs):
         data = dict(
             name='Abner Campanha',
@@ -232,3 +491,170 @@ class SubscriptionFormTest(TestCase):
         form = SubscriptionForm(data)
         form.is_valid()
         return form
+
+
+class SubscribeRaceTest(TestCase):
+
+    def setUp(self):
+        Subscription.objects.create(name='Abner Campanha', cpf='00000000000',
+            email='abnerpc@gmail.com', phone='12-34567890')
+
+    def test_integrity_error_is_form_error(self):
+        u'Inscrição concorrente que passou na validação vira erro do form.'
+        data = dict(name='Outro', cpf='00000000000', email='outro@gmail.com', phone='12-34567890')
+        with patch.object(SubscriptionForm, 'validate_unique'):
+            resp = self.client.post(r('subscriptions:subscribe'), data)
+        self.assertEqual(200, resp.status_code)
+        self.assertIn('cpf', resp.context['form'].errors)
+        self.assertEqual(1, Subscription.objects.count())
+        self.assertFalse(OutboxMessage.objects.exists())
+
+
+@skipIf(connection.vendor == 'sqlite' and connection.settings_dict['TEST_NAME'] in (None, '', ':memory:'),
+        u'Banco em memória não é compartilhado entre threads.')
+class SubscribeConcurrencyTest(TransactionTestCase):
+
+    def post(self, data, results):
+        try:
+            resp = Client().post(r('subscriptions:subscribe'), data)
+            results.append(resp.status_code)
+        except Exception, e:
+            results.append(e)
+        finally:
+            connection.close()
+
+    def test_parallel_posts(self):
+        u'POSTs paralelos com o mesmo CPF salvam apenas uma inscrição.'
+        results = []
+        threads = [
+            Thread(target=self.post, args=(dict(
+                name='Abner Campanha', cpf='00000000000',
+                email='inscrito%d@gmail.com' % i, phone='12-34567890'), results))
+            for i in range(8)]
+        with patch.object(SubscriptionForm, 'validate_unique'):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(1, Subscription.objects.count())
+        self.assertEqual(1, results.count(302))
+        self.assertEqual(7, results.count(200))
+
+
+class ImportSubscriptionsTest(TestCase):
+
+    def setUp(self):
+        Subscription.objects.create(name='Abner Campanha', cpf='00000000000',
+            email='abnerpc@gmail.com', phone='12-34567890')
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'inscricoes.csv')
+        with open(self.path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'cpf', 'email', 'phone'])
+            writer.writerow([u'João'.encode('utf-8'), '11111111111', 'joao@gmail.com', ''])
+            writer.writerow(['Maria', '22222222222', '', '21-98765432'])
+            writer.writerow(['Repetido', '00000000000', 'outro@gmail.com', ''])
+            writer.writerow(['Repetido no arquivo', '11111111111', 'outro@gmail.com', ''])
+            writer.writerow(['CPF invalido', '12345678900', 'x@gmail.com', ''])
+            writer.writerow(['Sem contato', '33333333333', '', ''])
+            writer.writerow(['Email repetido', '44444444444', 'abnerpc@gmail.com', ''])
+        call_command('import_subscriptions', self.path, batch_size=1, stdout=StringIO())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_daily_counts(self):
+        u'Inscrições importadas entram nos contadores diários.'
+        self.assertEqual(3, DailySubscriptionCount.objects.get().subscriptions)
+
+    def test_imported(self):
+        u'Linhas válidas são importadas.'
+        self.assertEqual(
+            [u'Abner Campanha', u'João', u'Maria'],
+            list(Subscription.objects.order_by('pk').values_list('name', flat=True)))
+        self.assertEqual('21-98765432', Subscription.objects.get(cpf='22222222222').phone)
+
+    def test_rejects(self):
+        u'Linhas recusadas são gravadas com o número da linha e o erro.'
+        with open(self.path + '.rejeitados.csv', 'rb') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(['linha', 'erro', 'name', 'cpf', 'email', 'phone'], rows[0])
+        self.assertEqual(['4', '5', '6', '7', '8'], [row[0] for row in rows[1:]])
+
+
+class ValidateCpfsTest(TestCase):
+
+    def test_reasons(self):
+        u'Cada CPF recebe o motivo da recusa.'
+        mask, reasons = validate_cpfs([
+            u'52998224725', u'529.982.247-25', u'52998224724', u'',
+            u'123', u'5299822472555', u'5299822472a'])
+        self.assertEqual([True, True, False, False, False, False, False], mask.tolist())
+        self.assertEqual(
+            [VALID, VALID, INVALID, REQUIRED, MIN_LENGTH, MAX_DIGITS, DIGITS_ONLY],
+            reasons.tolist())
+
+    def test_same_as_brcpffield(self):
+        u'O resultado em lote é igual ao do BRCPFField linha a linha.'
+        cpfs = [u'%011d' % (i * 7919) for i in range(2000)]
+        cpfs += [u' 2998224725', u'+2998224725', u'..........5', u'52998224725 ']
+        mask, reasons = validate_cpfs(cpfs)
+        self.assertEqual([scalar_reason(c) for c in cpfs], reasons.tolist())
+
+    def test_benchmark(self):
+        u'O benchmark confere o lote contra o BRCPFField.'
+        out = StringIO()
+        call_command('benchmark_cpf', rows=500, stdout=out)
+        self.assertIn('500 CPFs', out.getvalue())
+
+
+class DailySubscriptionCountTest(TestCase):
+
+    def setUp(self):
+        self.subscription = Subscription.objects.create(name='Abner Campanha',
+            cpf='01234567890', email='abnerpc@gmail.com')
+        Subscription.objects.create(name='Maria', cpf='11111111111',
+            email='maria@gmail.com', paid=True)
+
+    def counts(self):
+        return list(DailySubscriptionCount.objects.values_list('subscriptions', 'paid'))
+
+    def test_created(self):
+        u'Cada inscrição criada soma no dia.'
+        self.assertEqual([(2, 1)], self.counts())
+        self.assertEqual(timezone.localtime(self.subscription.created_at).date(),
+                         DailySubscriptionCount.objects.get().day)
+
+    def test_paid(self):
+        u'Marcar e desmarcar como paga atualiza o contador.'
+        self.subscription.paid = True
+        self.subscription.save()
+        self.assertEqual([(2, 2)], self.counts())
+        self.subscription.paid = False
+        self.subscription.save()
+        self.assertEqual([(2, 1)], self.counts())
+
+    def test_deleted(self):
+        u'Inscrições removidas são descontadas.'
+        Subscription.objects.all().delete()
+        self.assertEqual([(0, 0)], self.counts())
+
+    def test_mark_as_paid(self):
+        u'A marcação em blocos atualiza o contador de pagas.'
+        PaidUpdate.objects.start(Subscription.objects.all()).resume()
+        self.assertEqual([(2, 2)], self.counts())
+
+    def test_rebuild(self):
+        u'O comando recalcula os contadores a partir das inscrições.'
+        Subscription.objects.update(paid=True)
+        call_command('rebuild_daily_counts', stdout=StringIO())
+        self.assertEqual([(2, 2)], self.counts())
+
+    def test_stats_view(self):
+        u'A página de estatísticas lê apenas os contadores.'
+        User.objects.create_superuser('admin', 'admin@admin.com', 'admin')
+        assert self.client.login(username='admin', password='admin')
+        resp = self.client.get(r('admin:subscription_stats'))
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(2, resp.context['today'].subscriptions)
+        self.assertEqual({'subscriptions': 2, 'paid': 1}, resp.context['totals'])
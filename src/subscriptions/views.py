@@ -4,10 +4,10 @@ from django.http import HttpResponseRedirect
 from django.views.generic.simple import direct_to_template
 from .forms import SubscriptionForm
 from django.core.urlresolvers import reverse as r
-from django.core.mail import send_mail
 from django.conf import settings
+from django.db import transaction, IntegrityError
 from django.shortcuts import get_object_or_404
-from .models import Subscription
+from .models import Subscription, OutboxMessage
 
 
 def subscribe(request):
@@ -31,15 +31,22 @@ def create(request):
     if not form.is_valid():
         return direct_to_template(request, 'subscriptions/subscription_form.html', {'form': form})
 
-    subscription = form.save()
-
-    #envia o email
-    send_mail(
-        subject=u'Cadastrado com Sucesso',
-        message=u'Obrigado pela sua inscrição!',
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[subscription.email]
-        )
+    try:
+        with transaction.commit_on_success():
+            subscription = form.save()
+
+            #agenda o email, enviado pelo comando send_outbox
+            if subscription.email:
+                OutboxMessage.objects.enqueue(
+                    subject=u'Cadastrado com Sucesso',
+                    message=u'Obrigado pela sua inscrição!',
+                    recipient=subscription.email,
+                    from_email=settings.DEFAULT_FROM_EMAIL
+                    )
+    except IntegrityError:
+        if not form.set_integrity_error():
+            raise
+        return direct_to_template(request, 'subscriptions/subscription_form.html', {'form': form})
 
     return HttpResponseRedirect(r('subscriptions:success', args=[subscription.pk]))
 